@@ -4,6 +4,7 @@ import time
 import copy
 import sys
 import signal
+import argparse
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
 import random
@@ -19,17 +20,21 @@ from   PyQt5.QtGui           import QKeySequence, QPalette, QColor, QStandardIte
 # Custom backend functions
 import backend               as     bkd
 import backend.sentences     as     snt
+import backend.corpus        as     crp
+import backend.rules         as     rls
+from   backend.loader        import CorpusLoader
 
 class App(QMainWindow):
    r'''Main application.'''
 
-   def __init__(self, root: QApplication, iconsPath: str = 'icons', **kwargs) -> None:
+   def __init__(self, root: QApplication, iconsPath: str = 'icons', seed: Optional[int] = None, **kwargs) -> None:
       r'''
       Initialise the application.
       
       :param QApplication root: root object
       
       :param str iconsPath: (**Optional**) path where to find the icons
+      :param int seed: (**Optional**) seed of the random number generator. If None, the seed of the configuration file is used, and if it is not set either, a random seed is used. When a seed is given, the sentences already drawn during previous sessions are neither used nor updated, so that the same sentences are drawn with the same seed.
       '''
 
       self.root               = root
@@ -77,12 +82,22 @@ class App(QMainWindow):
             
          # Rules
          self.rules          = conf['rules']
-   
-         # Corpus
-         print('Generating corpus...')
-         self.corpusName     = conf['corpus']
-         self.corpusText     = snt.make_sentences(conf['corpusText'])
-         print('Corpus generated.')
+         
+         # Backend settings
+         self.backendConf    = conf['backend']
+         
+         # Random number generator used for all random choices, so that a game can be replayed given its seed
+         if seed is None:
+            seed             = self.backendConf['seed']
+            
+         #: Whether the seed was given, in which case the game must be replayable
+         self.seeded         = seed is not None
+            
+         if seed is None:
+            seed             = random.SystemRandom().randrange(2**32)
+            
+         print(f'Random seed: {seed}')
+         self.rng            = random.Random(seed)
    
          # Icons
          self.icons          = conf['icons']
@@ -90,17 +105,31 @@ class App(QMainWindow):
          # Language properties
          self.languageName   = conf['language']
          self.langAlteration = conf['languageAlterations']
-         self.language       = {'vowels'            : conf['vowels'], 
-                                'consonants'        : conf['consonants'], 
-                                'map_alternate'     : conf['map_alternate'], 
-                                'map_alternate_inv' : conf['map_alternate_inv']
-                               }
+         self.language       = conf['alphabet']
+   
+         # Corpus
+         print('Generating corpus...')
+         self.corpora        = crp.CorpusRegistry(opath.join(self.scriptDir, 'corpus'), self.language, 
+                                                  budget  = self.backendConf['corpusMemory'],
+                                                  workers = self.backendConf['corpusWorkers'],
+                                                  filters = self.backendConf['corpusFilters'])
+         
+         self.corpusDir      = opath.dirname(conf['corpusText'])
+         self.corpusName     = conf['corpus']
+         self.corpus         = self.corpora.get(conf['corpusText'])
+         self.corpusText     = self.corpus.sentences
+         
+         # Sampler avoiding sentences already played, also during previous sessions unless the seed was given
+         self.sampler        = crp.loadSampler(conf['corpusText'], self.corpus, resume=not self.seeded) if self.backendConf['noRepeat'] else None
+         print('Corpus generated.')
+         
+         # Threads loading other corpus files in the background
+         self.corpusLoader   = None
+         self.corpusLoaders  = set()
    
          # Sentence to be modified by the game
          self.sentence       = ''
          self.words          = []
-         self.vowels         = []
-         self.consonants     = []
          
          # Interface language
          self.translations   = conf['translations']
@@ -183,14 +212,10 @@ class App(QMainWindow):
          # Connect widgets to setting rules
          self.rulesNbGrSpin.valueChanged.connect( lambda value: self.setRule(nbPlayers = value,            which='Other_rule'))
          self.rulesTurnSpin.valueChanged.connect( lambda value: self.setRule(nbTurns = value,              which='Other_rule'))
-         self.rulesVow_Vow_S.stateChanged.connect(lambda value: self.setRule(VowtoVow_Single = value == 2, which='Modify_rule'))
-         self.rulesVow_Vow_A.stateChanged.connect(lambda value: self.setRule(VowtoVow_All = value == 2,    which='Modify_rule'))
-         self.rulesCon_Con_S.stateChanged.connect(lambda value: self.setRule(ContoCon_Single = value == 2, which='Modify_rule'))
-         self.rulesCon_Con_A.stateChanged.connect(lambda value: self.setRule(ContoCon_All = value == 2,    which='Modify_rule'))
-         self.rulesLet_Let_S.stateChanged.connect(lambda value: self.setRule(LettoLet_Single = value == 2, which='Modify_rule'))
-         self.rulesLet_Let_A.stateChanged.connect(lambda value: self.setRule(LettoLet_All = value == 2,    which='Modify_rule'))
-         self.rulesDel.stateChanged.connect(      lambda value: self.setRule(Delete = value == 2,          which='Modify_rule'))
-         self.rulesSwap.stateChanged.connect(     lambda value: self.setRule(Swap = value == 2,            which='Modify_rule'))
+         
+         # Each rule of the registry is enabled by its own checkbox
+         for rule in rls.RULES.values():
+            getattr(self, rule.widget).stateChanged.connect(lambda value, name=rule.name: self.setRule(which='Modify_rule', **{name: value == 2}))
    
          # Main window layout
          self.layoutWin.addWidget(self.tabs, 1, 1)
@@ -933,10 +958,18 @@ class App(QMainWindow):
       r'''Actions taken when the new sentence button is pressed.'''
 
       # Update sentence
-      self.sentence, self.words, nb = snt.pick_sentence(self.corpusText, self.minwordSpin.value(), self.maxwordSpin.value())
-      sentence_split                = self.sentence.split(' ')
-      if sentence_split[0] in ['--', '-']:
-           self.sentence            = self.sentence[len(sentence_split[0])+1:]
+      if self.sampler is None:
+          pos                       = self.corpus.pick(self.minwordSpin.value(), self.maxwordSpin.value(), rng=self.rng)
+      else:
+          pos                       = self.sampler.draw(self.minwordSpin.value(), self.maxwordSpin.value(), rng=self.rng)
+      
+      if pos is None:
+          self.statusbar.showMessage(f'No sentence with {self.minwordSpin.value()} to {self.maxwordSpin.value()} words found in corpus {self.corpusName}.')
+          return
+      
+      self.sentence                 = self.corpusText[pos]
+      self.words                    = snt.make_words(self.sentence)
+      nb                            = len(self.words)
       
       # Update label
       self.senLabel.setText('*' * len(self.sentence))
@@ -950,9 +983,6 @@ class App(QMainWindow):
       self.senBox.setTitle(f"{self.trans_prop['senBox']['title']} - {nb:d} {word}")
       self.resetGame()
       
-      # Extract vowels and consonants from sentence
-      self.vowels, self.consonants  = snt.make_vowels_consonants(self.sentence, self.language)
-      
       return
   
     
@@ -979,35 +1009,29 @@ class App(QMainWindow):
    def startGame(self, *args, **kwargs) -> None:
        r'''Start the game.'''
        
-       # Create as many groups as necessary
+       # Pick the rule of each turn beforehand among the enabled rules which are implemented
        nbGroups     = self.rulesNbGrSpin.value()
-       groups       = [bkd.LanguageGroup(self.sentence, self.language, self.vowels, self.consonants, idd=f"{self.trans_prop['model']['headers'][0]} {i:d}") for i in range(1, nbGroups+1)]
-       
-       # Loop through each turn
        nbTurns      = self.rulesTurnSpin.value()
-       for i in range(nbTurns):
-           
-           # Pick a rule (we will remove the loop once we've included all the methods)
-           print(self.rules['Modify_rule'])
-           print([key for key, value in self.rules['Modify_rule'].items() if value])
-           rule     = random.choice(list(self.rules['Modify_rule'].keys()))
-           while rule not in ['VowtoVow_All', 'VowtoVow_Single', 'ContoCon_All', 'ContoCon_Single', 'Swap']:
-               rule = random.choice(list(self.rules['Modify_rule'].keys()))
-           
-           # Loop through each group
-           for group in groups:
-               msg  = group.applyRule(rule)
-               print(msg)
-               
-           
+       rules        = rls.implemented(rule for rule, enabled in self.rules['Modify_rule'].items() if enabled)
+       
+       if len(rules) == 0:
+           self.statusbar.showMessage('No implemented rule is enabled in the settings.')
+           return
+       
+       schedule     = [self.rng.choice(rules) for i in range(nbTurns)]
+       
+       # Apply the rules of each turn to the sentence of each group, all the groups at once or in a pool of processes if possible
+       ids          = [f"{self.trans_prop['model']['headers'][0]} {i:d}" for i in range(1, nbGroups+1)]
+       histories, messages = bkd.playGroups(snt.Sentence(self.sentence, self.language), self.language, schedule, ids, self.rng,
+                                            batch   = self.backendConf['batchGroups'],
+                                            workers = self.backendConf['groupWorkers'])
+       
+       for msg in messages:
+           print(msg)
                
        # Add each group to the treeview
-       for group in groups:
-           name     = group.id
-           turn     = len(group.sentence)-1
-           sentence = group.sentence[-1]
-           
-           self.addLine(name, turn, sentence)
+       for name, history in zip(ids, histories):
+           self.addLine(name, len(history)-1, history[-1])
            
        # Avoid users launching another batch again
        self.playButton.setEnabled(False)
@@ -1046,40 +1070,30 @@ class App(QMainWindow):
    def validateGame(self, *args, **kwargs) -> None:
        r'''Actions taken when the validate button is hit.'''
        
-       # User sentence split in words, but keeping characters such as ,
-       sentence                      = self.guessEntry.text()
-       sentence_split                = sentence.split(' ')
-       sentence_rec                  = ''
-       
-       # Words from the user guess
-       words                         = snt.make_words(sentence)
+       # User guess split into tokens, keeping the text between them
+       guess                         = snt.Sentence(self.guessEntry.text(), self.language)
+       sentence_rec                  = guess.gaps[0]
        
        score                         = 0
+       nb                            = 0
        
-       for guess, true, full in zip(words, self.words, sentence_split):
-           
-           # Split full word to only keep the word part of it
-           full_split                = full.partition(guess)
+       for token, isWord, gap in zip(guess.tokens, guess.isWord, guess.gaps[1:]):
            
-           for pos in range(3):
-               
-               # We only colorise the word, not the characters around
-               if pos != 1:
-                   sentence_rec     += full_split[pos]
-               else:
+           # We only colorise words, not the characters around
+           if isWord and nb < len(self.words):
        
-                   # If guess is similar to the word, we apply ok color, else we apply bad color
-                   if guess.lower() == true.lower():
-                       sentence_rec += self.setOkText(full_split[pos])
-                       score        += 1
-                   else:
-                       sentence_rec += self.setBadText(full_split[pos])
-                       
-           sentence_rec             += ' '
-           
-       # Need to deal with punctuation at the end
-       if sentence_split[-1] in ['!', '?', '.', ',', ';', ':'] and sentence_split[-1] != sentence_rec[-2]:
-           sentence_rec             += sentence_split[-1]
+               # If guess is similar to the word, we apply ok color, else we apply bad color
+               if token.lower() == self.words[nb].lower():
+                   sentence_rec     += self.setOkText(token)
+                   score            += 1
+               else:
+                   sentence_rec     += self.setBadText(token)
+                   
+               nb                   += 1
+           else:
+               sentence_rec         += token
+               
+           sentence_rec             += gap
        
        self.senLabel.setText(self.sentence)
        self.guessLabel.setText(sentence_rec)
@@ -1105,22 +1119,99 @@ class App(QMainWindow):
       self.inputEntry.setText(name)
       return
 
-   def _updateCorpusProp(self, file: str, *args, **kwargs) -> None:
+   def _setCorpus(self, file: str, corpus: crp.Corpus, *args, **kwargs) -> None:
       r'''
-      Update corpus properties.
+      Set the current corpus.
 
-      :param str file: file name to retrieve the text from
+      :param str file: corpus file
+      :param Corpus corpus: corpus data
       '''
 
-      dir, name = opath.split(file)
-      with open(file, 'r') as f:
-         text = f.read()
+      dir, name       = opath.split(file)
+
+      # Sentences drawn from the previous corpus are saved before its sampler is replaced
+      self._saveSampler()
 
       # Update corpus properties
+      self.corpus     = corpus
       self.corpusDir  = dir
       self.corpusName = name
-      self.corpusText = text
+      self.corpusText = corpus.sentences
+      self.sampler    = crp.loadSampler(file, corpus, resume=not self.seeded) if self.backendConf['noRepeat'] else None
 
+      self.statusbar.showMessage(f'Loaded corpus {name} with {len(corpus):d} sentences.')
+      return
+
+   def _saveSampler(self, *args, **kwargs) -> None:
+      r'''Save the sentences drawn from the current corpus so that the next sessions do not draw them again. Nothing is saved when the seed was given, see __init__.'''
+
+      if self.sampler is not None and not self.seeded:
+         crp.saveSampler(opath.join(self.corpusDir, self.corpusName), self.corpus, self.sampler)
+
+      return
+
+   def _updateCorpusProp(self, file: str, *args, **kwargs) -> None:
+      r'''
+      Update corpus properties. Corpora used recently are kept in memory by the registry and are set immediately. Other ones are loaded in a background thread and the current corpus stays in use until they are ready.
+
+      :param str file: file name to retrieve the text from
+      '''
+
+      # Only the last selected file must be loaded
+      if self.corpusLoader is not None:
+         self.corpusLoader.cancel()
+         self.corpusLoader = None
+
+      if file in self.corpora:
+         self._setCorpus(file, self.corpora.get(file))
+         return
+
+      name                = opath.basename(file)
+      loader              = CorpusLoader(self.corpora, file)
+      loader.progress.connect(lambda value, name=name: self.statusbar.showMessage(f'Loading corpus {name}... {value:d}%'))
+      loader.loaded.connect(self._corpusLoaded)
+      loader.failed.connect(self._corpusFailed)
+      loader.finished.connect(lambda loader=loader: self.corpusLoaders.discard(loader))
+
+      # Keep a reference to the thread until it finishes, even if it is cancelled
+      self.corpusLoaders.add(loader)
+      self.corpusLoader   = loader
+      loader.start()
+
+      return
+
+   @pyqtSlot(str, object)
+   def _corpusLoaded(self, file: str, corpus: crp.Corpus, *args, **kwargs) -> None:
+      r'''
+      Actions taken when a corpus was loaded in the background.
+
+      :param str file: corpus file
+      :param Corpus corpus: corpus data
+      '''
+
+      # Skip corpora which were replaced by another selection in the meantime
+      if self.corpusLoader is None or file != self.corpusLoader.file:
+         return
+
+      self.corpusLoader = None
+      self._setCorpus(file, self.corpora.add(file, corpus))
+      return
+
+   @pyqtSlot(str, str)
+   def _corpusFailed(self, file: str, msg: str, *args, **kwargs) -> None:
+      r'''
+      Actions taken when a corpus could not be loaded in the background.
+
+      :param str file: corpus file
+      :param str msg: error message
+      '''
+
+      if self.corpusLoader is None or file != self.corpusLoader.file:
+         return
+
+      self.corpusLoader = None
+      self.errorCorpus()
+      self.statusbar.showMessage(f'Corpus {opath.basename(file)} could not be loaded: {msg}')
       return
 
    def errorCorpus(self, *args, **kwargs) -> None:
@@ -1152,11 +1243,11 @@ class App(QMainWindow):
 
       if corpus is not None:
 
-         # Update corpus properties first (dir, file name and text)
+         # Update corpus properties (dir, file name and text), possibly once loaded in the background
          self._updateCorpusProp(corpus)
 
          # Update corpus entry widget
-         self._changeCorpusEntry(self.corpusName)
+         self._changeCorpusEntry(opath.basename(corpus))
 
       return
 
@@ -1238,6 +1329,22 @@ class App(QMainWindow):
 
       return
 
+   def closeEvent(self, event, *args, **kwargs) -> None:
+      r'''
+      Stop the threads loading corpora and save the sentences drawn before closing the window.
+
+      :param event: close event
+      '''
+
+      for loader in list(self.corpusLoaders):
+         loader.cancel()
+         loader.wait()
+
+      self._saveSampler()
+
+      super().closeEvent(event)
+      return
+
    def checkFile(self, file: str, *args, **kwargs) -> bool:
       r'''
       Check that the given file exists.
@@ -1342,13 +1449,14 @@ class App(QMainWindow):
        alterations = self.langAlteration
        rules       = self._confRules
        theme       = self.theme
+       backend     = self.backendConf
        
        # Need to update the rules according to the state of each rule in self.rules dict
        for which, values in self.rules.items():
           for item, value in values.items():
              rules[which][item]['value'] = value
        
-       bkd.saveConfig('configuration.yaml', corpus=corpus, interface=interface, language=language, alterations=alterations, rules=rules, theme=f'{theme}.qss')
+       bkd.saveConfig('configuration.yaml', corpus=corpus, interface=interface, language=language, alterations=alterations, rules=rules, theme=f'{theme}.qss', backend=backend)
           
        # Grey out save icon
        self.saveButton.setEnabled(False)
@@ -1397,7 +1505,7 @@ class App(QMainWindow):
       except AttributeError:
          return -2
       
-      if objName in ['rulesVow_Vow_S', 'rulesVow_Vow_A', 'rulesCon_Con_S', 'rulesCon_Con_A', 'rulesLet_Let_S', 'rules_Let_Let_A', 'rulesDel', 'rulesSwap']:
+      if objName in rls.widgets():
          if value:
             value = Qt.Checked
          else:
@@ -1411,6 +1519,12 @@ class App(QMainWindow):
 
 
 if __name__ == '__main__':
-   root   = QApplication(sys.argv)
-   app    = App(root)
+   parser       = argparse.ArgumentParser(description='Jeu des langues')
+   parser.add_argument('--seed', type=int, default=None, help='seed of the random number generator, used to replay a game')
+   
+   # Remaining arguments are left to Qt
+   args, qtArgs = parser.parse_known_args()
+   
+   root         = QApplication(sys.argv[:1] + qtArgs)
+   app          = App(root, seed=args.seed)
    sys.exit(root.exec_())
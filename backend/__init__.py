@@ -2,242 +2,163 @@
 # Mercier Wilfried - IRAP
 
 import yaml
+import random
+import numpy             as     np
 import os.path           as     opath
 from   functools         import reduce
+from   concurrent.futures import ProcessPoolExecutor
 from   glob              import glob
-from   copy              import deepcopy
 from   typing            import Union, List, Optional, Any
 from   PyQt5.QtGui       import QIcon, QPixmap
 
 # Custom imports
 import backend.sentences as     sen
+import backend.rules     as     rules
+from   backend.language  import Language, load_pack
+from   backend.batch     import SentenceBatch
+
+#: Default values of the backend settings, used when they are missing from the configuration file
+BACKEND_DEFAULTS = {'corpusMemory'  : 512,
+                    'corpusWorkers' : 1,
+                    'groupWorkers'  : 1,
+                    'wordTokenizer' : 'regex',
+                    'seed'          : None,
+                    'noRepeat'      : True,
+                    'batchGroups'   : True,
+                    'corpusFilters' : {'collapseSpaces' : True,
+                                       'stripDashes'    : True,
+                                       'dropHeaders'    : True,
+                                       'dropLetterless' : True
+                                      }
+                   }
+
+#: Estimate of the time taken to start a pool of processes and send it a game, in µs. Groups are only played in a pool when playing them one by one is expected to take longer, see rules.cost.
+POOL_OVERHEAD    = 50000
 
 class LanguageGroup:
     r'''A class which combines all data relative to a language group.'''
     
-    def __init__(self, sentence: str, language: dict, vowels: List[str], consonants: List[str], idd: Optional[str] = None, *args, **kwargs) -> None:
+    def __init__(self, sentence: sen.Sentence, language: dict, idd: Optional[str] = None, seed: Optional[int] = None, *args, **kwargs) -> None:
         r'''
         Init method for this class.
         
-        :param str sentence: main sentence which is going to be modified
-        :param dict language: dictionary representing the considered language
-        :param list vowels: list of vowels in the sentence
-        :param list consonants: list of consonants in the sentence
+        :param Sentence sentence: main sentence which is going to be modified. It is copied so that it can be shared between groups.
+        :param Language language: alphabet of the considered language. It is shared, not copied, since it cannot be modified.
         
         :param str idd: (**Optional**) identifier for this language group
+        :param int seed: (**Optional**) seed of the random number generator of the group. If None, the generator is seeded from the system.
         '''
         
         #: Identifier
         self.id          = idd
         
-        # Keep track of sentences each turn in a list
-        self.sentence    = [sentence]
+        #: Random number generator used by the rules, independent of the other groups
+        self.rng         = random.Random(seed)
         
-        # Vowels and consonants in the sentence
-        self.consonants  = deepcopy(consonants)
-        self.vowels      = deepcopy(vowels)
+        #: Sentence modified by the rules
+        self.sentence    = sentence.copy()
         
-        # Language dict
-        self.language    = deepcopy(language)
+        # Keep track of sentences each turn in a list
+        self.history     = [sentence.text]
         
-        # Rule methods
-        self.ruleMethods = {'VowtoVow_All'    : self.VowtoVow_All,
-                            'VowtoVow_Single' : self.VowtoVow_Single,
-                            'ContoCon_All'    : self.ContoCon_All,
-                            'ContoCon_Single' : self.ContoCon_Single,
-                            'Swap'            : self.Swap
-                           }
+        # Language alphabet
+        self.language    = language
         
-    def applyRule(self, rule: str, *args, **kwargs) -> str:
-        r''''
-        Apply a given rule to the current sentence.
+    @property
+    def occurrences(self) -> dict:
+        r'''Number of occurrences of each vowel and consonant in the current sentence. Counts are updated by the sentence for the tokens modified by each rule, so that they are never computed again from the whole sentence.'''
         
-        :param str rule: rule to apply
+        return {**self.sentence.vowelCounts, **self.sentence.consonantCounts}
         
-        :returns: message to output in admin mode
-        :rtype: str
-        '''
-        
-        if rule not in self.ruleMethods:
-            print(f'No rule {rule} found in rules methods {self.ruleMethods.keys()}')
-            msg = None
-        else:
-            msg = self.ruleMethods[rule](len(self.sentence))
-            
-        return msg
-    
-    
-    ###################################
-    #              Rules              #
-    ###################################
-    
-    def ContoCon_All(self, turn: str, *args, **kwargs) -> str:
+    def applyRule(self, rule: str, rng: Optional[random.Random] = None, *args, **kwargs) -> str:
         r''''
-        Consonant to consonant on all words rule.
-        
-        :param str turn: name of the turn to put in the sentence dict
+        Apply a given rule to the current sentence. The rule is looked up in the rule registry, see rules.RULES.
         
-        :returns: output message for admin mode
-        :rtype: str
-        '''
-        
-        # Transform sentence
-        out                 = sen.ContoCon_All(self.sentence[-1], self.language, consonants=self.consonants)
-        if None not in out:
-
-            sentence        = out[0]
-            consonants      = out[1]
-            consonant_out   = out[2] 
-            consonant_in    = out[3]
-            
-            # Update vowels
-            self.consonants = consonants
-            
-            # Update sentence
-            self.sentence.append(sentence)
-            
-            # Message to output for admin mode
-            msg         = f'Turn {turn}: {self.id} changed consonant {consonant_out} to consonant {consonant_in} in every word.'
-        else:
-            self.sentence.append(self.sentence[-1])
-            msg         = f'Turn {turn}: {self.id} made no modifications because no consonant was found in the sentence.'
-        
-        return msg
-        
-    def ContoCon_Single(self, turn: str, *args, **kwargs) -> str:
-        r''''
-        Consonant to consonant on a single word rule.
-        
-        :param str turn: name of the turn to put in the sentence dict
-        
-        :returns: output message for admin mode
-        :rtype: str
-        '''
-        
-        # Transform sentence
-        out                 = sen.ContoCon_Single(self.sentence[-1], self.language, consonants_sen=self.consonants)
-        if None not in out:
-        
-            sentence        = out[0]
-            word            = out[1]
-            consonants      = out[2]
-            consonant_out   = out[3] 
-            consonant_in    = out[4]
-            
-            # Update vowels
-            self.consonants = consonants
-            
-            # Update sentence
-            self.sentence.append(sentence)
-        
-            # Message to output for admin mode
-            msg             = f'Turn {turn}: {self.id} changed consonant {consonant_out} to consonant {consonant_in} in word {word}.'
-        else:
-            self.sentence.append(self.sentence[-1])
-            msg             = f'Turn {turn}: {self.id} made no modifications because no consonant was found in sentence.' 
-            
-        return msg
-    
-    def Swap(self, turn: str, *args, **kwargs) -> str:
-        r'''
-        Swap two consecutive words rule.
-        
-        :param str turn: name of the turn to put in the sentence dict
-        
-        :returns: output message for admin mode
-        :rtype: str
-        '''
-        
-        # Transform sentence
-        out          = sen.Swap(self.sentence[-1])
-        
-        if None not in out:
-            
-            sentence = out[0]
-            word1    = out[1]
-            word2    = out[2]
-            
-            self.sentence.append(sentence)
-            
-            # Message to output for admin mode
-            msg      = f'Turn {turn}: {self.id} swaped word {word1} with word {word2}.'
-        else:
-            self.sentence.append(self.sentence[-1])
-            msg      = f'Turn {turn}: {self.id} made no modifications because no words could be swaped.'
-            
-        return msg
-    
-    def VowtoVow_All(self, turn: str, *args, **kwargs) -> str:
-        r''''
-        Vowel to vowel on all words rule.
-        
-        :param str turn: name of the turn to put in the sentence dict
-        
-        :returns: output message for admin mode
-        :rtype: str
-        '''
-        
-        # Transform sentence
-        out             = sen.VowtoVow_All(self.sentence[-1], self.language, vowels=self.vowels)
-        if None not in out:
-
-            sentence    = out[0]
-            vowels      = out[1]
-            vowel_out   = out[2] 
-            vowel_in    = out[3]
-            
-            # Update vowels
-            self.vowels = vowels
-            
-            # Update sentence
-            self.sentence.append(sentence)
-            
-            # Message to output for admin mode
-            msg         = f'Turn {turn}: {self.id} changed vowel {vowel_out} to vowel {vowel_in} in every word.'
-        else:
-            self.sentence.append(self.sentence[-1])
-            msg         = f'Turn {turn}: {self.id} made no modifications because no vowel was found in the sentence.'
-        
-        return msg
-        
-    def VowtoVow_Single(self, turn: str, *args, **kwargs) -> str:
-        r''''
-        Vowel to vowel on a single word rule.
+        :param str rule: rule to apply
         
-        :param str turn: name of the turn to put in the sentence dict
+        :param random.Random rng: (**Optional**) random number generator used by the rule. If None, the generator of the group is used.
         
-        :returns: output message for admin mode
+        :returns: message to output in admin mode
         :rtype: str
         '''
         
-        # Transform sentence
-        out             = sen.VowtoVow_Single(self.sentence[-1], self.language, vowels_sen=self.vowels)
-        if None not in out:
-        
-            sentence    = out[0]
-            word        = out[1]
-            vowels      = out[2]
-            vowel_out   = out[3] 
-            vowel_in    = out[4]
-            
-            # Update vowels
-            self.vowels = vowels
-            
-            # Update sentence
-            self.sentence.append(sentence)
-        
-            # Message to output for admin mode
-            msg         = f'Turn {turn}: {self.id} changed vowel {vowel_out} to vowel {vowel_in} in word {word}.'
+        if rule not in rules.implemented([rule]):
+            print(f'No rule {rule} found in rules methods {rules.implemented(rules.RULES)}')
+            msg    = None
         else:
-            self.sentence.append(self.sentence[-1])
-            msg         = f'Turn {turn}: {self.id} made no modifications because no vowel was found in sentence.'
+            turn   = len(self.history)
+            result = rules.RULES[rule].apply(self.sentence, self.language, rng=rng or self.rng)
+            msg    = rules.RULES[rule].describe(result, turn, self.id)
+            self.history.append(self.sentence.text)
             
         return msg
 
 
-#######################################
-#          Loading utilities          #
-#######################################
+#: Sentence, language and schedule of the game played by a worker process. See _initGame.
+_GAME = {}
+
+def _initGame(sentence: sen.Sentence, language: dict, schedule: List[str]) -> None:
+   r'''Keep the game shared by all the groups in a worker process, so that it is only sent once to each process rather than with each group. See playGroups.'''
+
+   _GAME.update(sentence=sentence, language=language, schedule=schedule)
+   return
+
+def _playPooled(idd: str, seed: int) -> Union[List[str], List[str]]:
+   r'''Play a single group of the game kept by _initGame in a worker process. See playGroups.'''
+
+   return _playGroup(_GAME['sentence'], _GAME['language'], _GAME['schedule'], idd, seed)
+
+def _playGroup(sentence: sen.Sentence, language: dict, schedule: List[str], idd: str, seed: int) -> Union[List[str], List[str]]:
+   r'''Apply the rules of each turn to the sentence of a single group. See playGroups.'''
+
+   group         = LanguageGroup(sentence, language, idd=idd, seed=seed)
+   messages      = [group.applyRule(rule) for rule in schedule]
+
+   return group.history, messages
+
+def playGroups(sentence: sen.Sentence, language: dict, schedule: List[str], ids: List[str], rng: random.Random, batch: bool = True, workers: int = 1) -> Union[List[List[str]], List[str]]:
+   r'''
+   Apply the rules of each turn to the sentence of each language group.
+
+   :param Sentence sentence: sentence given to each group
+   :param Language language: alphabet of the language used
+   :param list[str] schedule: rule applied by the groups at each turn
+   :param list[str] ids: identifier of each group
+   :param random.Random rng: random number generator from which the generators of the groups are seeded
+
+   :param bool batch: (**Optional**) whether to apply each rule to all the groups at once (see batch.SentenceBatch). Groups are played one by one if a rule of the schedule has no batched function.
+   :param int workers: (**Optional**) number of processes playing the groups when they are played one by one. A pool is only started if the estimated time of the game exceeds POOL_OVERHEAD. Each group is played with its own seed, so that the sentences and messages only depend on the seed of rng and on batch, never on the number of processes. Batched games are always played in the main process, so workers is ignored unless batch is False.
+
+   :returns: sentence of each group before the first turn and after each turn, messages to output in admin mode
+   :rtype: list[list[str]], list[str]
+   '''
+
+   if batch and all(rules.RULES[rule].batch is not None for rule in schedule):
+      sentences  = SentenceBatch(sentence, len(ids))
+      generator  = np.random.default_rng(rng.getrandbits(64))
+      turns      = [sentences.texts()]
+      messages   = []
+
+      for turn, rule in enumerate(schedule, start=1):
+         results = rules.RULES[rule].applyBatch(sentences, generator)
+         messages += [rules.RULES[rule].describe(result, turn, idd) for idd, result in zip(ids, results)]
+         turns.append(sentences.texts())
+
+      return [list(history) for history in zip(*turns)], messages
+
+   # Groups only share the schedule, so each one can be played on its own once its seed is drawn
+   seeds         = [rng.getrandbits(64) for idd in ids]
+
+   if workers > 1 and len(ids) > 1 and rules.cost(schedule) * len(ids) > POOL_OVERHEAD:
+      with ProcessPoolExecutor(max_workers=workers, initializer=_initGame, initargs=(sentence, language, schedule)) as pool:
+         plays   = list(pool.map(_playPooled, ids, seeds, chunksize=max(len(ids) // (4*workers), 1)))
+   else:
+      plays      = [_playGroup(sentence, language, schedule, idd, seed) for idd, seed in zip(ids, seeds)]
+
+   # Messages are ordered by turn, then by group, as if all the groups played each turn before the next one
+   messages      = [play[1][turn] for turn in range(len(schedule)) for play in plays]
+
+   return [play[0] for play in plays], messages
 
 def loadCorpus(scriptPath: str, corpusFile: str) -> Union[str, bool, str]:
    r'''
@@ -293,7 +214,7 @@ def loadIcons(scriptPath: str, formats: List[str] = ['xbm', 'xpm', 'png', 'bmp',
 
    return conf, ok, msg
 
-def loadLanguage(scriptPath: str, languageFile: str, alt: bool = True) -> Union[dict, bool, str]:
+def loadLanguage(scriptPath: str, languageFile: str, alt: bool = True) -> Union[Language, bool, str]:
    r'''
    Load and setup language properties.
 
@@ -302,40 +223,17 @@ def loadLanguage(scriptPath: str, languageFile: str, alt: bool = True) -> Union[
 
    :param bool alt: (**Optional**) whether to consider alterate forms as independent letters or not
 
-   :returns: language dictionary defining vowels and consonants, ok flag and error message
-   :rtype: dict, bool, str
+   :returns: language defining vowels and consonants, ok flag and error message
+   :rtype: Language, bool, str
    '''
 
    path       = opath.join(scriptPath, 'languages')
    file       = opath.join(path, languageFile)
 
    if opath.isfile(file):
-      with open(file, 'r') as f:
-         conf = yaml.load(f, Loader=yaml.Loader)
-
-      # If we consider alternations, alternated forms must not appear in the vowel and consonant lists, but we must keep track by mapping them to their parent form
-      if alt:
-         conf['map_alternate']     = {}
-         conf['map_alternate_inv'] = conf['alterations']
-
-         for letter, alterations in conf['alterations'].items():
-            for alteration in alterations:
-               conf['map_alternate'][alteration] = letter
-
-      # If we do not consider alternations, then alternated forms are considered as different characters and must be included into the vowel and consonant lists
-      else:
-         conf['map_alternate']     = {}
-         conf['map_alternate_inv'] = {}
-
-         for letter, alterations in conf['alterations'].items():
-            if letter in conf['consonants']:
-               conf['consonants'] += alterations
-            elif letter in conf['vowels']:
-               conf['vowels']     += alterations
-            else:
-               print(f'Alterations {alterations} of letter {letter} could not be broadcast to neither consonants, nor vowels.')
-
-      conf.pop('alterations')
+
+      # Languages are compiled once into a pack, with and without alternations, and only compiled again when the language file changes
+      conf    = load_pack(file, alt=alt)
       ok      = True
       msg     = ''
    else:
@@ -406,14 +304,16 @@ def saveConfig(file: str,
                language:str = None, 
                alterations: bool = None, 
                rules: dict = None,
-               theme: str = None) -> None:
+               theme: str = None,
+               backend: dict = None) -> None:
    r'''Save settings into configuration file.'''
    
-   if None in [corpus, interface, language, alterations, rules, theme]:
+   if None in [corpus, interface, language, alterations, rules, theme, backend]:
       raise ValueError('One of the variables in saveConfig is None.')
    
    # Build out dict and yaml string
-   out_d = {'corpus'              : corpus,
+   out_d = {'backend'             : backend,
+            'corpus'              : corpus,
             'interfaceLanguage'   : interface + '.yaml',
             'language'            : language,
             'languageAlterations' : alterations,
@@ -467,6 +367,18 @@ def setup(scriptPath: str, configFile: str, parent: Any = None) -> Union[dict, b
       with open(file, 'r') as f:
          conf                   = yaml.load(f, Loader=yaml.Loader)
 
+      # Backend settings missing from the configuration file get their default value
+      conf['backend']           = {**BACKEND_DEFAULTS, **conf.get('backend', {})}
+      conf['backend']['corpusFilters'] = {**BACKEND_DEFAULTS['corpusFilters'], **conf['backend']['corpusFilters']}
+
+      if conf['backend']['batchGroups'] and conf['backend']['groupWorkers'] > 1:
+         print(f'groupWorkers ({conf["backend"]["groupWorkers"]}) is ignored since batchGroups is true: batched games are played in a single process.')
+
+      try:
+         sen.set_word_tokenizer(conf['backend']['wordTokenizer'])
+      except ValueError as e:
+         return {}, False, str(e)
+
       # Splashscreen
       if parent is not None:
          parent.splashlabel.setText('Loading icons...')
@@ -517,10 +429,7 @@ def setup(scriptPath: str, configFile: str, parent: Any = None) -> Union[dict, b
          return {}, ok, msg
 
       # Add vowels and consonants into the conf dict
-      conf['vowels']            = language['vowels']
-      conf['consonants']        = language['consonants']
-      conf['map_alternate']     = language['map_alternate']
-      conf['map_alternate_inv'] = language['map_alternate_inv']
+      conf['alphabet']          = language
       
       # Splashscreen
       if parent is not None:
@@ -0,0 +1,339 @@
+# Sentences of several language groups modified at once with numpy
+# Mercier Wilfried - IRAP
+
+import numpy             as     np
+from   typing            import Any
+
+# Custom imports
+from   backend.language  import VOWEL, CONSONANT
+
+class SentenceBatch:
+    r'''
+    Copies of a sentence, one for each language group, stored as a matrix of code points so that a rule is applied to all the groups in a single numpy pass.
+
+    Each token of each copy is a row of code points padded with zeros, and the text between tokens is shared by all the copies since rules never modify it:
+
+        codes[group, token, char]
+
+    Letters are replaced through the letter lookup table of the language, swaps permute the tokens of each copy and deletions compact the code points of the tokens.
+    '''
+
+    def __init__(self, sentence: Any, size: int, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param Sentence sentence: sentence copied for each group
+        :param int size: number of groups
+        '''
+
+        #: Alphabet of the language used
+        self.language    = sentence.language
+
+        #: Text between tokens, shared by all the groups. There is one more gap than tokens.
+        self.gaps        = list(sentence.gaps)
+
+        #: Whether each gap between two tokens is made of spaces, i.e. whether they can be swapped
+        self.spaces      = np.array([gap.isspace() for gap in self.gaps[1:-1]], dtype=bool)
+
+        #: Whether each token of each group is a word
+        self.isWord      = np.tile(np.array(sentence.isWord, dtype=bool), (size, 1))
+
+        width            = max(map(len, sentence.tokens), default=1)
+
+        #: Code points of each token of each group, padded with zeros
+        self.codes       = np.zeros((size, len(sentence.tokens), width), dtype=np.uint32)
+
+        for pos, token in enumerate(sentence.tokens):
+            self.codes[:, pos, :len(token)] = encode(token)
+
+        # Rules only put letters of the alphabet into the tokens, so lookup tables covering the initial code points cover every code point met later
+        span             = max(int(self.codes.max(initial=0)) + 1, len(self.language.lookup))
+
+        #: Position in the letter masks of the letter of each code point (-1 for characters which are not letters). See Language.lookup.
+        self.lookup      = np.full(span, -1, dtype=np.int16)
+        self.lookup[:len(self.language.lookup)] = self.language.lookup
+
+        #: Lower case code point of each code point, used to find the occurences of a word
+        self.lower       = np.array([ord(low) if len(low := chr(code).lower()) == 1 else code for code in range(span)], dtype=np.uint32)
+
+        #: Whether each letter of the letter masks is a vowel or a consonant
+        self.vowel       = np.array([self.language.table[letter][0] == VOWEL     for letter in self.language.letters], dtype=bool)
+        self.consonant   = np.array([self.language.table[letter][0] == CONSONANT for letter in self.language.letters], dtype=bool)
+
+    def __len__(self) -> int:
+        r'''Number of groups.'''
+
+        return self.codes.shape[0]
+
+    def presence(self) -> np.ndarray:
+        r'''
+        Letters appearing in each token of each group, alternate forms being counted with their letter.
+
+        :returns: array of shape (groups, tokens, letters) which is True where a letter appears in a token
+        :rtype: ndarray[bool]
+        '''
+
+        groups, tokens, width = self.codes.shape
+        letters               = len(self.language.letters)
+
+        # Characters which are not letters are put in an additional first column which is dropped afterwards
+        cells                 = np.arange(groups * tokens, dtype=np.int64).reshape(groups, tokens, 1) * (letters + 1)
+        presence              = np.zeros(groups * tokens * (letters + 1), dtype=bool)
+        presence[(cells + self.lookup[self.codes] + 1).ravel()] = True
+
+        return presence.reshape(groups, tokens, letters + 1)[..., 1:]
+
+    def occurences(self, pos: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        r'''
+        Occurences in each group of the word at a given position, regardless of the case.
+
+        :param ndarray[int] pos: position of the word in each group
+        :param ndarray[bool] valid: whether a word was picked in each group
+
+        :returns: array of shape (groups, tokens) which is True for the tokens equal to the word
+        :rtype: ndarray[bool]
+        '''
+
+        lower = self.lower[self.codes]
+        word  = lower[np.arange(len(self)), pos]
+
+        return (lower == word[:, None, :]).all(axis=-1) & self.isWord & valid[:, None]
+
+    def replace(self, tokens: np.ndarray, letterOut: np.ndarray, codeIn: np.ndarray) -> None:
+        r'''
+        Replace a letter, and its alternate forms if alternations are considered, by another one in some tokens of each group. Letters replaced by a zero code point are deleted.
+
+        :param ndarray[bool] tokens: array of shape (groups, tokens) which is True for the tokens to modify
+        :param ndarray[int] letterOut: position in the letter masks of the letter to replace in each group
+        :param ndarray[uint32] codeIn: code point of the letter put instead in each group
+        '''
+
+        hit            = (self.lookup[self.codes] == letterOut[:, None, None]) & tokens[..., None]
+        self.codes     = np.where(hit, codeIn.astype(np.uint32)[:, None, None], self.codes)
+
+        # Deleted letters leave zeros which are moved to the end of the tokens
+        if (codeIn[tokens.any(axis=1)] == 0).any():
+            order      = np.argsort(self.codes == 0, axis=-1, kind='stable')
+            self.codes = np.take_along_axis(self.codes, order, axis=-1)
+
+        return
+
+    def swap(self, pos: np.ndarray, valid: np.ndarray) -> None:
+        r'''
+        Swap a token with the next one in each group. Gaps stay in place.
+
+        :param ndarray[int] pos: position of the first token in each group
+        :param ndarray[bool] valid: whether tokens are swapped in each group
+        '''
+
+        rows           = np.nonzero(valid)[0]
+        pos            = pos[rows]
+
+        for values in (self.codes, self.isWord):
+            values[rows, pos], values[rows, pos+1] = values[rows, pos+1], values[rows, pos].copy()
+
+        return
+
+    def words(self, pos: np.ndarray) -> list[str]:
+        r'''
+        Text of the token at a given position in each group.
+
+        :param ndarray[int] pos: position of the token in each group
+
+        :returns: token of each group
+        :rtype: list[str]
+        '''
+
+        return decode(self.codes[np.arange(len(self)), pos])
+
+    def texts(self) -> list[str]:
+        r'''
+        Text of the sentence of each group.
+
+        :returns: sentence of each group
+        :rtype: list[str]
+        '''
+
+        groups, tokens, width = self.codes.shape
+        blocks                = [np.broadcast_to(encode(self.gaps[0]), (groups, len(self.gaps[0])))]
+
+        for pos, gap in enumerate(self.gaps[1:]):
+            blocks           += [self.codes[:, pos], np.broadcast_to(encode(gap), (groups, len(gap)))]
+
+        return [text.replace('\x00', '') for text in decode(np.concatenate(blocks, axis=1))]
+
+
+#################################
+#       Code point arrays       #
+#################################
+
+def encode(text):
+   '''
+   Code points of a text.
+
+   :param str text: text
+
+   :returns: code points
+   :rtype: ndarray[uint32]
+   '''
+
+   return np.frombuffer(text.encode('utf-32-le'), dtype='<u4').astype(np.uint32)
+
+def decode(codes):
+   '''
+   Texts of the rows of a code point matrix. Trailing zeros are removed.
+
+   :param ndarray[uint32] codes: array of shape (rows, width)
+
+   :returns: text of each row
+   :rtype: list[str]
+   '''
+
+   rows, width = codes.shape
+   if width == 0:
+      return [''] * rows
+
+   text        = np.ascontiguousarray(codes, dtype='<u4').tobytes().decode('utf-32-le')
+
+   return [text[start:start+width].rstrip('\x00') for start in range(0, len(text), width)]
+
+def choose(candidates, rng):
+   '''
+   Pick uniformly a candidate in each row of a boolean matrix.
+
+   :param ndarray[bool] candidates: array of shape (rows, candidates) which is True for the candidates of each row
+   :param numpy.random.Generator rng: random number generator
+
+   :returns: position of the candidate picked in each row (0 if a row has none), whether each row has a candidate
+   :rtype: ndarray[int], ndarray[bool]
+   '''
+
+   counts = candidates.sum(axis=1)
+   picked = (rng.random(len(counts)) * counts).astype(np.int64)
+   valid  = counts > 0
+
+   if candidates.shape[1] == 0:
+      return picked, valid
+
+   return (candidates.cumsum(axis=1) > picked[:, None]).argmax(axis=1), valid
+
+def results(valid, *fields):
+   '''
+   Values returned by a batched rule for each group, in the same form as the values returned by the rules applied to a single sentence.
+
+   :param ndarray[bool] valid: whether each group was modified
+   :param fields: value of each field for each group
+
+   :returns: values for each group, or None for the groups which were not modified
+   :rtype: list[Optional[tuple]]
+   '''
+
+   return [values if ok else None for ok, values in zip(valid.tolist(), zip(*fields))]
+
+
+#################################
+#        Modify sentences       #
+#################################
+
+def change_all(sentences, kinds, choices, rng):
+   '''
+   Replace a letter picked in the sentence of each group by another one in every word.
+
+   :param SentenceBatch sentences: sentences to modify in place
+   :param ndarray[bool] kinds: letters of the letter masks which can be picked
+   :param list[str] choices: letters which can be put instead
+   :param numpy.random.Generator rng: random number generator
+
+   :returns: letter removed and letter added in each group, or None for the groups without such letters
+   :rtype: list[Optional[tuple[str, str]]]
+   '''
+
+   rows             = np.arange(len(sentences))
+   presence         = sentences.presence()
+   letterOut, valid = choose(presence.any(axis=1) & kinds, rng)
+   letterIn         = rng.integers(len(choices), size=len(sentences))
+
+   sentences.replace(presence[rows, :, letterOut] & valid[:, None], letterOut, encode(''.join(choices))[letterIn])
+
+   letters          = sentences.language.letters
+   return results(valid, [letters[pos] for pos in letterOut.tolist()], [choices[pos] for pos in letterIn.tolist()])
+
+def change_single(sentences, kinds, choices, rng, minLetters=1):
+   '''
+   Replace a letter by another one in a word picked in the sentence of each group, and in every occurence of this word. If no letter is put instead, the letter is deleted.
+
+   :param SentenceBatch sentences: sentences to modify in place
+   :param ndarray[bool] kinds: letters of the letter masks which can be picked
+   :param list[str] choices: letters which can be put instead. If empty, the letter is deleted.
+   :param numpy.random.Generator rng: random number generator
+
+   :param int minLetters: (**Optional**) minimum number of different letters a word must have to be picked
+
+   :returns: word picked, letter removed and letter added in each group, or None for the groups without such words
+   :rtype: list[Optional[tuple[str, ...]]]
+   '''
+
+   rows             = np.arange(len(sentences))
+   presence         = sentences.presence() & kinds
+   pos, valid       = choose(sentences.isWord & (presence.sum(axis=-1) >= minLetters), rng)
+   letterOut, _     = choose(presence[rows, pos], rng)
+   words            = sentences.words(pos)
+
+   if len(choices) == 0:
+      codeIn        = np.zeros(len(sentences), dtype=np.uint32)
+      fields        = ()
+   else:
+      letterIn      = rng.integers(len(choices), size=len(sentences))
+      codeIn        = encode(''.join(choices))[letterIn]
+      fields        = ([choices[pos] for pos in letterIn.tolist()],)
+
+   sentences.replace(sentences.occurences(pos, valid), letterOut, codeIn)
+
+   letters          = sentences.language.letters
+   return results(valid, words, [letters[pos] for pos in letterOut.tolist()], *fields)
+
+def VowtoVow_All(sentences, rng):
+   '''Batched version of sentences.VowtoVow_All.'''
+
+   return change_all(sentences, sentences.vowel, sentences.language['vowels'], rng)
+
+def VowtoVow_Single(sentences, rng):
+   '''Batched version of sentences.VowtoVow_Single.'''
+
+   return change_single(sentences, sentences.vowel, sentences.language['vowels'], rng)
+
+def ContoCon_All(sentences, rng):
+   '''Batched version of sentences.ContoCon_All.'''
+
+   return change_all(sentences, sentences.consonant, sentences.language['consonants'], rng)
+
+def ContoCon_Single(sentences, rng):
+   '''Batched version of sentences.ContoCon_Single.'''
+
+   return change_single(sentences, sentences.consonant, sentences.language['consonants'], rng)
+
+def LettoLet_All(sentences, rng):
+   '''Batched version of sentences.LettoLet_All.'''
+
+   return change_all(sentences, sentences.vowel | sentences.consonant, sentences.language['vowels'] + sentences.language['consonants'], rng)
+
+def LettoLet_Single(sentences, rng):
+   '''Batched version of sentences.LettoLet_Single.'''
+
+   return change_single(sentences, sentences.vowel | sentences.consonant, sentences.language['vowels'] + sentences.language['consonants'], rng)
+
+def Delete(sentences, rng):
+   '''Batched version of sentences.Delete.'''
+
+   return change_single(sentences, sentences.vowel | sentences.consonant, (), rng, minLetters=2)
+
+def Swap(sentences, rng):
+   '''Batched version of sentences.Swap.'''
+
+   pos, valid = choose(sentences.isWord[:, :-1] & sentences.isWord[:, 1:] & sentences.spaces, rng)
+   words1     = sentences.words(pos)
+   words2     = sentences.words(np.minimum(pos+1, sentences.codes.shape[1]-1))
+
+   sentences.swap(pos, valid)
+
+   return results(valid, words1, words2)
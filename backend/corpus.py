@@ -0,0 +1,756 @@
+# Corpus data derived from corpus files and the cache storing them
+# Mercier Wilfried - IRAP
+
+import os
+import sys
+import pickle
+import random
+import hashlib
+import numpy              as     np
+import os.path            as     opath
+from   array              import array
+from   collections        import OrderedDict
+from   glob               import glob
+from   importlib.metadata import version, PackageNotFoundError
+from   typing             import Optional, Callable, Any
+
+# Custom imports
+import backend.sentences  as     sen
+from   backend.index      import WordCountIndex, FeatureIndex, NoRepeatSampler, popcount
+from   backend.language   import Language, as_language
+from   backend.store      import SentenceStore, SentenceStoreWriter, replacing, write_rows, map_rows
+
+#: Version of the cache format. It must be increased each time the content of the cache changes.
+CACHE_VERSION = 9
+
+#: Number of bytes read at the start of a corpus file and before the end of its indexed part to check that text was only appended to it
+FINGERPRINT_SIZE = 65536
+
+class LoadingCancelled(Exception):
+    r'''Exception raised when the loading of a corpus is cancelled.'''
+
+class Corpus:
+    r'''A class which combines all data derived from a corpus file.'''
+
+    def __init__(self, sentences, counts, letters: np.ndarray, language: Language, features: dict, key: Optional[dict] = None, words=None, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param sentences: sentences of the corpus
+        :type sentences: list[str] or SentenceStore
+        :param counts: number of words of each sentence
+        :param ndarray[uint64] letters: letter mask of each sentence. See sentences.make_letter_masks.
+        :param Language language: alphabet of the language the letter masks refer to
+        :param dict features: number of characters ('chars'), number of positions where words can be swapped ('swaps') and rarity of the words ('rarity', see rarities) of each sentence. If the rarity is missing or None, it is computed from **words** the first time it is needed.
+
+        :param dict key: (**Optional**) key of the corpus file the data were derived from. See cacheKey.
+        :param words: (**Optional**) identifier of each word of the corpus, sentence after sentence. It is only used to compute the rarity if it is not given.
+        :type words: array or ndarray[uint32]
+        '''
+
+        #: Sentences
+        self.sentences  = sentences
+
+        #: Key of the corpus file the data were derived from
+        self.key        = key
+
+        #: Index used to draw sentences given a number of words
+        self.index      = WordCountIndex(counts)
+
+        #: Letters appearing in each sentence
+        self.letters    = np.asarray(letters, dtype=np.uint64).reshape(len(self.index), language.words)
+
+        self.language   = language
+
+        #: Identifier of each word of the corpus, sentence after sentence
+        self.words      = words
+
+        #: Value of each feature used to select sentences, for each sentence. See select.
+        self.features   = {'words'      : self.index.counts,
+                           'chars'      : np.asarray(features['chars'],  dtype=np.int32),
+                           'vowels'     : popcount(self.letters & language.vowelMask).sum(axis=1).astype(np.int16),
+                           'consonants' : popcount(self.letters & language.consonantMask).sum(axis=1).astype(np.int16),
+                           'swaps'      : np.asarray(features['swaps'],  dtype=np.int32)
+                          }
+
+        if features.get('rarity') is not None:
+            self.features['rarity'] = np.asarray(features['rarity'], dtype=np.float32)
+
+        # Index of the features, built the first time a sentence is selected
+        self._features  = None
+
+        # Memory estimate computed the first time it is needed
+        self._memory    = None
+
+    def __len__(self) -> int:
+        r'''Number of sentences in the corpus.'''
+
+        return len(self.sentences)
+
+    def pick(self, minWords: int, maxWords: int, rng: Any = random, *args, **kwargs) -> Optional[int]:
+        r'''
+        Pick a sentence with a number of words between minWords and maxWords (included).
+
+        :param int minWords: minimum number of words
+        :param int maxWords: maximum number of words
+
+        :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+
+        :returns: position of the sentence or None if no sentence matches
+        :rtype: int or None
+        '''
+
+        return self.index.draw(minWords, maxWords, rng=rng)
+
+    def sample(self, n: int, minWords: int, maxWords: int, replace: bool = True, rng: Any = None, *args, **kwargs):
+        r'''
+        Pick n sentences with a number of words between minWords and maxWords (included) at once. See WordCountIndex.sample.
+
+        :param int n: number of sentences to pick
+        :param int minWords: minimum number of words
+        :param int maxWords: maximum number of words
+
+        :param bool replace: (**Optional**) whether the same sentence can be picked several times or not
+        :param rng: (**Optional**) random number generator or seed
+
+        :returns: positions of the sentences
+        :rtype: ndarray[int]
+
+        :raises ValueError: if not enough sentences match
+        '''
+
+        return self.index.sample(n, minWords, maxWords, replace=replace, rng=rng)
+
+    @property
+    def featureIndex(self) -> FeatureIndex:
+        r'''Index of the features of the sentences. It is built the first time it is used.'''
+
+        if self._features is None:
+
+            # The rarity depends on the frequency of the words in the whole corpus, so it is not computed when text is appended to the corpus file until it is used
+            if 'rarity' not in self.features:
+                self.features['rarity'] = rarities(self.words, self.index.counts)
+
+            self._features = FeatureIndex(self.features)
+            self._memory   = None
+
+        return self._features
+
+    def select(self, filters: dict, rng: Any = random, *args, **kwargs) -> Optional[int]:
+        r'''
+        Pick a sentence whose features are all in given ranges. Available features are
+
+            - words: number of words
+            - chars: number of characters
+            - vowels: number of different vowels
+            - consonants: number of different consonants
+            - swaps: number of positions where two words can be swapped
+            - rarity: mean of -log10 of the frequency of the words of the sentence in the corpus
+
+        For instance, filters={'words': (5, 10), 'rarity': (None, 3.5)} selects a sentence with 5 to 10 words and a rarity of at most 3.5.
+
+        :param dict filters: range of values (minimum, maximum), both included, for some features. None can be used for an unbounded side.
+
+        :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+
+        :returns: position of the sentence or None if no sentence matches
+        :rtype: int or None
+
+        :raises KeyError: if a filter is given for an unknown feature
+        '''
+
+        return self.featureIndex.draw(filters, rng=rng)
+
+    def memory(self) -> int:
+        r'''
+        Estimate of the memory used by the corpus, including memory-mapped sentences which are paged in by the system when they are accessed.
+
+        :returns: number of bytes
+        :rtype: int
+        '''
+
+        if self._memory is None:
+            index            = self.index.counts.nbytes + self.index.order.nbytes + self.index.offsets.nbytes
+            index           += sum(values.nbytes for name, values in self.features.items() if name != 'words')
+
+            if self._features is not None:
+                index       += self._features.all.nbytes + sum(bitmaps.nbytes for bitmaps in self._features.bitmaps.values())
+            inventories      = self.letters.nbytes
+
+            if isinstance(self.sentences, SentenceStore):
+                sentences    = len(self.sentences.blob) + self.sentences.bounds.nbytes
+            else:
+                sentences    = sum(sys.getsizeof(sentence) for sentence in self.sentences)
+
+            self._memory     = index + inventories + sentences
+
+        return self._memory
+
+
+class CorpusRegistry:
+    r'''Registry of the corpus files found in a directory. Corpora are only loaded when they are used and the least recently used ones are dropped when the memory budget is exceeded.'''
+
+    def __init__(self, path: str, language: dict, budget: float = 512, punkt: str = 'French', workers: int = 1, filters: dict = {}, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param str path: directory where corpus files are looked for
+        :param dict language: dictionary describing the language used
+
+        :param float budget: (**Optional**) memory budget in MB. The most recently used corpus is always kept, even if it exceeds the budget alone.
+        :param dict filters: (**Optional**) options used to normalise and filter the sentences. See sentences.clean_sentence.
+        :param str punkt: (**Optional**) language used by the nltk.tokenize.punkt module
+        :param int workers: (**Optional**) number of processes used to tokenize a corpus which is not in cache
+        '''
+
+        #: Directory where corpus files are looked for
+        self.path     = path
+
+        #: Memory budget in bytes
+        self.budget   = budget*1024**2
+
+        self.language = language
+        self.punkt    = punkt
+        self.workers  = workers
+        self.filters  = filters
+
+        #: Loaded corpora, from the least to the most recently used
+        self.loaded   = OrderedDict()
+
+        #: Corpus files found in the directory
+        self.files    = self.discover()
+
+    def __contains__(self, file: str) -> bool:
+        r'''Whether a corpus file is currently loaded and up to date. See current.'''
+
+        return self.current(opath.realpath(file))
+
+    def current(self, file: str) -> bool:
+        r'''
+        Whether the data of a corpus file are loaded and still up to date, i.e. the file was not modified since they were built. Data which are not up to date anymore are dropped.
+
+        :param str file: real path of the corpus file
+
+        :returns: True if the loaded data can be used, False otherwise
+        :rtype: bool
+        '''
+
+        if file not in self.loaded:
+            return False
+
+        try:
+            current = self.loaded[file].key == cacheKey(file, self.language, punkt=self.punkt, filters=self.filters)
+        except OSError:
+            current = False
+
+        if not current:
+            del self.loaded[file]
+
+        return current
+
+    def discover(self) -> list[str]:
+        r'''
+        Find the corpus files in the directory of the registry.
+
+        :returns: corpus files
+        :rtype: list[str]
+        '''
+
+        self.files = sorted(glob(opath.join(self.path, '*.txt')))
+        return self.files
+
+    def add(self, file: str, corpus: Corpus) -> Corpus:
+        r'''
+        Add the data of a corpus file built outside of the registry, for instance in another thread. See build.
+
+        :param str file: corpus file
+        :param Corpus corpus: corpus data
+
+        :returns: corpus data
+        :rtype: Corpus
+        '''
+
+        file               = opath.realpath(file)
+        self.loaded[file]  = corpus
+        self.loaded.move_to_end(file)
+        self.evict()
+
+        return corpus
+
+    def build(self, file: str, progress: Optional[Callable[[int], None]] = None, cancel: Optional[Callable[[], bool]] = None) -> Corpus:
+        r'''
+        Build or load from cache the data of a corpus file without adding them to the registry. It does not modify the registry and can therefore be run in another thread.
+
+        :param str file: corpus file
+
+        :param progress: (**Optional**) function called with the percentage of the corpus processed so far
+        :param cancel: (**Optional**) function returning True if loading must be stopped
+
+        :returns: corpus data
+        :rtype: Corpus
+
+        :raises LoadingCancelled: if loading is cancelled
+        '''
+
+        return makeCorpus(file, self.language, punkt=self.punkt, workers=self.workers, filters=self.filters, progress=progress, cancel=cancel)
+
+    def get(self, file: str, *args, **kwargs) -> Corpus:
+        r'''
+        Get the data of a corpus file, loading or building them if they are not already loaded or if the file was modified since then.
+
+        :param str file: corpus file. It does not need to be in the directory of the registry.
+
+        :returns: corpus data
+        :rtype: Corpus
+        '''
+
+        file               = opath.realpath(file)
+
+        if self.current(file):
+            self.loaded.move_to_end(file)
+            return self.loaded[file]
+
+        return self.add(file, self.build(file))
+
+    def memory(self) -> int:
+        r'''
+        Estimate of the memory used by all the loaded corpora.
+
+        :returns: number of bytes
+        :rtype: int
+        '''
+
+        return sum(corpus.memory() for corpus in self.loaded.values())
+
+    def evict(self) -> None:
+        r'''Drop the least recently used corpora until the memory budget is met.'''
+
+        while len(self.loaded) > 1 and self.memory() > self.budget:
+            file, corpus = self.loaded.popitem(last=False)
+            print(f'Corpus {file} dropped from memory.')
+
+        return
+
+
+#################################
+#         Cache handling        #
+#################################
+
+def cacheFile(file: str) -> str:
+   r'''
+   Name of the cache file associated to a corpus file. The sentences themselves are stored in a SentenceStore with the same name without extension.
+
+   :param str file: corpus file
+
+   :returns: cache file
+   :rtype: str
+   '''
+
+   return f'{opath.splitext(file)[0]}.cache'
+
+def cacheKey(file: str, language: dict, punkt: str = 'French', filters: dict = {}) -> dict:
+   r'''
+   Key identifying the data derived from a corpus file. If any of its values changes, the cache must be rebuilt.
+
+   :param str file: corpus file
+   :param dict language: dictionary describing the language used
+
+   :param dict filters: (**Optional**) options used to normalise and filter the sentences. See sentences.clean_sentence.
+   :param str punkt: (**Optional**) language used by the nltk.tokenize.punkt module
+
+   :returns: key
+   :rtype: dict
+   '''
+
+   stat         = os.stat(file)
+
+   # Letter masks depend on the alphabet, including the order of its letters, and on whether alternations are considered or not
+   alphabet     = repr((list(language['vowels']), list(language['consonants']), sorted(language['map_alternate'].items())))
+
+   try:
+      tokenizer = version('nltk')
+   except PackageNotFoundError:
+      tokenizer = None
+
+   return {'version'   : CACHE_VERSION,
+           'size'      : stat.st_size,
+           'mtime'     : stat.st_mtime_ns,
+           'punkt'     : punkt,
+           'tokenizer' : tokenizer,
+           'words'     : sen.word_tokenizer,
+           'filters'   : sorted(filters.items()),
+           'alphabet'  : hashlib.sha1(alphabet.encode()).hexdigest()
+          }
+
+def fingerprint(file: str, offset: int) -> str:
+   r'''
+   Fingerprint of the part of a corpus file before a given position. Only the start of the file and the bytes just before the position are used, so that it is cheap to compute for large files.
+
+   :param str file: corpus file
+   :param int offset: position in bytes of the end of the part of the file used
+
+   :returns: fingerprint
+   :rtype: str
+   '''
+
+   digest = hashlib.sha1()
+   with open(file, 'rb') as f:
+      digest.update(f.read(min(offset, FINGERPRINT_SIZE)))
+
+      f.seek(max(offset - FINGERPRINT_SIZE, 0))
+      digest.update(f.read(offset - f.tell()))
+
+   return digest.hexdigest()
+
+def readCache(file: str) -> tuple[Optional[dict], Optional[dict]]:
+   r'''
+   Read the key and the data stored in the cache of a corpus file, whatever the key is.
+
+   :param str file: corpus file
+
+   :returns: key and data, or None for both if the cache, its sentence store or its letters and words do not exist or cannot be read
+   :rtype: tuple[dict or None, dict or None]
+   '''
+
+   cache    = cacheFile(file)
+   store    = opath.splitext(file)[0]
+   if not opath.isfile(cache) or not SentenceStore.exists(store) or not opath.isfile(f'{store}.letters') or not opath.isfile(f'{store}.words'):
+      return None, None
+
+   try:
+      with open(cache, 'rb') as f:
+         key  = pickle.load(f)
+         data = pickle.load(f)
+   except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+      print(f'Cache {cache} could not be read ({e}).')
+      return None, None
+
+   return key, data
+
+def loadCache(file: str, key: dict, language: Language) -> Optional[Corpus]:
+   r'''
+   Load the data derived from a corpus file from its cache.
+
+   :param str file: corpus file
+   :param dict key: key the cache must have to be used. See cacheKey.
+   :param Language language: alphabet of the language used
+
+   :returns: corpus data if the cache exists and is up to date, None otherwise
+   :rtype: Corpus or None
+   '''
+
+   cache    = cacheFile(file)
+   store    = opath.splitext(file)[0]
+   if not opath.isfile(cache) or not SentenceStore.exists(store) or not opath.isfile(f'{store}.letters') or not opath.isfile(f'{store}.words'):
+      return None
+
+   try:
+      with open(cache, 'rb') as f:
+
+         # The key is stored first so that stale caches are not loaded entirely
+         if pickle.load(f) != key:
+            return None
+
+         data = pickle.load(f)
+   except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+      print(f'Cache {cache} could not be read ({e}).')
+      return None
+
+   sentences = SentenceStore(store)
+   try:
+      if len(sentences) != len(data['counts']):
+         raise ValueError(f'{len(sentences)} sentences instead of {len(data["counts"])}')
+
+      letters   = map_rows(f'{store}.letters', '<u8', (len(sentences), language.words))
+      words     = map_rows(f'{store}.words',   '<u4', (int(np.sum(data['counts'])),))
+   except ValueError as e:
+      print(f'Sentence store {store} does not match cache {cache} ({e}).')
+      return None
+
+   return Corpus(sentences, data['counts'], letters, language, data['features'], key=key, words=words)
+
+def appendedCache(file: str, key: dict) -> Optional[dict]:
+   r'''
+   Check whether the cache of a corpus file can be updated incrementally, that is if text was only appended to the file since the cache was written.
+
+   :param str file: corpus file
+   :param dict key: current key of the corpus file. See cacheKey.
+
+   :returns: data stored in the cache if it can be updated incrementally, None otherwise
+   :rtype: dict or None
+   '''
+
+   old, data = readCache(file)
+   if old is None or 'resume' not in data:
+      return None
+
+   # Only the size and the modification time of the file may differ
+   if any(old.get(name) != value for name, value in key.items() if name not in ('size', 'mtime')):
+      return None
+
+   resume    = data['resume']
+   if key['size'] <= resume['offset'] or fingerprint(file, resume['offset']) != resume['fingerprint']:
+      return None
+
+   if len(SentenceStore(opath.splitext(file)[0])) != len(data['counts']):
+      return None
+
+   return data
+
+def saveCache(file: str, key: dict, corpus: Corpus, resume: Optional[dict] = None) -> None:
+   r'''
+   Save the data derived from a corpus file into its cache. The sentences must already be written in the corresponding SentenceStore, and the letter masks and the words of the sentences next to it. See makeCorpus.
+
+   :param str file: corpus file
+   :param dict key: key identifying the data. See cacheKey.
+   :param Corpus corpus: corpus data
+
+   :param dict resume: (**Optional**) state of the tokenizer at the end of the file and vocabulary of the corpus, used to update the cache incrementally if text is appended to the file. See sentences.iter_sentences and makeCorpus.
+   '''
+
+   cache = cacheFile(file)
+   data  = {'counts'     : corpus.index.counts,
+            'features'   : {name: corpus.features.get(name) for name in ('chars', 'swaps', 'rarity')},
+            'resume'     : resume
+           }
+
+   # Write into a temporary file first so that an interrupted write never leaves a corrupted cache behind
+   with replacing(cache) as f:
+      pickle.dump(key,  f)
+      pickle.dump(data, f)
+
+   return
+
+def rarities(words, counts) -> np.ndarray:
+   r'''
+   Rarity of the words of each sentence, i.e. the mean over the words of the sentence of -log10 of their frequency in the corpus. Sentences without words have a rarity of 0.
+
+   :param words: identifier of each word of the corpus, sentence after sentence
+   :type words: array or ndarray[uint32]
+   :param counts: number of words of each sentence
+
+   :returns: rarity of each sentence
+   :rtype: ndarray[float32]
+   '''
+
+   words       = np.asarray(words, dtype=np.uint32)
+   counts      = np.asarray(counts, dtype=np.int64)
+
+   if len(words) == 0:
+      return np.zeros(len(counts), dtype=np.float32)
+
+   frequency   = np.bincount(words) / len(words)
+   information = -np.log10(frequency[words])
+
+   # Sum over each sentence as differences of the cumulative sum at the bounds of the sentences
+   cumulated   = np.concatenate(([0], np.cumsum(information)))
+   ends        = np.cumsum(counts)
+
+   return ((cumulated[ends] - cumulated[ends - counts]) / np.maximum(counts, 1)).astype(np.float32)
+
+def seenFile(file: str) -> str:
+   r'''
+   Name of the file storing the sentences of a corpus file already drawn. See NoRepeatSampler.
+
+   :param str file: corpus file
+
+   :returns: file name
+   :rtype: str
+   '''
+
+   return f'{opath.splitext(file)[0]}.seen'
+
+def loadSampler(file: str, corpus: Corpus, resume: bool = True) -> NoRepeatSampler:
+   r'''
+   Sampler drawing the sentences of a corpus without repetition, continuing from the state saved during the previous sessions if the corpus did not change since then.
+
+   :param str file: corpus file
+   :param Corpus corpus: corpus data
+
+   :param bool resume: (**Optional**) whether to continue from the saved state. If False, the sentences drawn only depend on the random number generator given to the sampler, e.g. to replay a game from its seed.
+
+   :returns: sampler
+   :rtype: NoRepeatSampler
+   '''
+
+   seen      = seenFile(file)
+   if resume and corpus.key is not None and opath.isfile(seen):
+      try:
+         with open(seen, 'rb') as f:
+            if pickle.load(f) == corpus.key:
+               return NoRepeatSampler(corpus.index, **pickle.load(f))
+      except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+         print(f'File {seen} could not be read ({e}).')
+
+   return NoRepeatSampler(corpus.index)
+
+def saveSampler(file: str, corpus: Corpus, sampler: NoRepeatSampler) -> None:
+   r'''
+   Save the state of a sampler so that the next sessions do not draw the same sentences. Nothing is saved if the corpus has no key. The whole bitset is written, so this is meant to be called when a corpus stops being used rather than after each draw.
+
+   :param str file: corpus file
+   :param Corpus corpus: corpus data
+   :param NoRepeatSampler sampler: sampler used to draw the sentences of the corpus
+   '''
+
+   if corpus.key is None:
+      return
+
+   seen = seenFile(file)
+   with replacing(seen) as f:
+      pickle.dump(corpus.key,      f)
+      pickle.dump(sampler.state(), f)
+
+   return
+
+def makeCorpus(file: str, language: dict, punkt: str = 'French', cache: bool = True, workers: int = 1, filters: dict = {},
+               progress: Optional[Callable[[int], None]] = None, cancel: Optional[Callable[[], bool]] = None) -> Corpus:
+   r'''
+   Build the data derived from a corpus file, or load it from the cache if it is up to date. If text was only appended to the file since the cache was written, only the new text is tokenized.
+
+   :param str file: corpus file
+   :param dict language: dictionary describing the language used
+
+   :param bool cache: (**Optional**) whether to use and update the cache or not. If True, sentences are directly written into a SentenceStore while the corpus is tokenized.
+   :param cancel: (**Optional**) function returning True if building must be stopped. It is called after each sentence.
+   :param dict filters: (**Optional**) options used to normalise and filter the sentences. See sentences.clean_sentence.
+   :param progress: (**Optional**) function called with the percentage of the corpus processed so far. It is called each time this percentage changes.
+   :param str punkt: (**Optional**) language used by the nltk.tokenize.punkt module
+   :param int workers: (**Optional**) number of processes used to tokenize the corpus
+
+   :returns: corpus data
+   :rtype: Corpus
+
+   :raises LoadingCancelled: if **cancel** returns True before the corpus is built
+   '''
+
+   key                 = cacheKey(file, language, punkt=punkt, filters=filters)
+   language            = as_language(language)
+
+   if cache:
+      corpus           = loadCache(file, key, language)
+
+      if corpus is not None:
+         print(f'Loaded corpus data from cache {cacheFile(file)}.')
+         return corpus
+
+   data                = appendedCache(file, key) if cache else None
+
+   # Values of the new sentences only, the values of the kept ones being added once all the sentences are tokenized
+   counts              = []
+   chars               = []
+   swaps               = []
+   words               = array('I')
+
+   if data is None:
+      keep             = None
+      offset           = 0
+      carry            = ''
+      kept             = {'counts': np.zeros(0, dtype=np.int32), 'chars': np.zeros(0, dtype=np.int32), 'swaps': np.zeros(0, dtype=np.int32)}
+      vocabulary       = {}
+   else:
+
+      # The last sentences of the previous tokenization may be modified by the appended text and are tokenized again
+      keep             = len(data['counts']) - data['resume']['provisional']
+      offset           = data['resume']['offset']
+      carry            = data['resume']['carry']
+      kept             = {'counts': data['counts'][:keep], 'chars': data['features']['chars'][:keep], 'swaps': data['features']['swaps'][:keep]}
+
+      # Identifiers of the words of the new sentences continue those of the previous ones, stored next to the sentence store
+      vocabulary       = {word: pos for pos, word in enumerate(data['resume']['vocabulary'])}
+
+   size                = max(key['size'] - offset, 1)
+   state               = {}
+
+   # Number of kept sentences which come from the last sentences of the tokenization, see sentences.iter_sentences
+   provisional         = 0
+
+   def analyse(sentences):
+      r'''Clean the sentences, drop unusable ones, and compute the features of the others while they are tokenized.'''
+
+      nonlocal provisional
+
+      read             = 0
+      percent          = 0
+      for sentence in sentences:
+         if cancel is not None and cancel():
+            raise LoadingCancelled(f'Loading of corpus {file} cancelled.')
+
+         # Number of characters is used as an estimate of the number of bytes read
+         read         += len(sentence) + 1
+         if progress is not None and min(99, 100*read // size) > percent:
+            percent    = min(99, 100*read // size)
+            progress(percent)
+
+         sentence      = sen.clean_sentence(sentence, **filters)
+         if sentence is None:
+            continue
+
+         # The state is filled just before the last sentences are yielded
+         if 'provisional' in state:
+            provisional += 1
+
+         sentenceWords = sen.make_words(sentence)
+
+         counts.append(len(sentenceWords))
+         chars.append(len(sentence))
+         swaps.append(sen.count_swaps(sentence))
+         words.extend(vocabulary.setdefault(word.lower(), len(vocabulary)) for word in sentenceWords)
+
+         yield sentence
+
+   if keep is None:
+      print(f'Tokenizing text from {file} with {workers} process(es)...')
+   else:
+      print(f'Tokenizing text appended to {file} since the cache was written...')
+
+   sentences           = analyse(sen.iter_sentences(file, language=punkt, workers=workers, offset=offset, carry=carry, state=state))
+
+   if cache:
+      store            = opath.splitext(file)[0]
+      with SentenceStoreWriter(store, keep=keep) as writer:
+         for sentence in sentences:
+            writer.append(sentence)
+
+         # The last sentences, letter masks and words are replaced in place from here on, so the cache must not be used anymore if writing stops
+         if keep is not None:
+            os.remove(cacheFile(file))
+
+      sentences        = SentenceStore(store)
+
+      # Letters of the new sentences are found once they are all tokenized, in a single vectorized pass
+      letters          = sen.make_letter_masks(sentences.blob, sentences.offsets(keep or 0), language)
+
+      # Only the values of the new sentences are written, after those of the kept ones
+      write_rows(f'{store}.letters', letters, start=keep)
+      write_rows(f'{store}.words',   np.asarray(words, dtype='<u4'), start=None if keep is None else int(np.sum(kept['counts'])))
+   else:
+      sentences        = list(sentences)
+      encoded          = [sentence.encode('utf-8') for sentence in sentences]
+      letters          = sen.make_letter_masks(b''.join(encoded), np.cumsum([0] + [len(sentence) for sentence in encoded]), language)
+
+   print(f'{len(sentences)} sentences created.')
+   counts              = np.concatenate((kept['counts'], np.asarray(counts, dtype=np.int32)))
+   features            = {name: np.concatenate((kept[name], np.asarray(values, dtype=np.int32))) for name, values in (('chars', chars), ('swaps', swaps))}
+
+   # The rarity of all the sentences changes with the frequencies of the words, so after an append it is only computed when it is used, see Corpus.featureIndex
+   if keep is None:
+      features['rarity'] = rarities(words, counts)
+
+   if cache:
+      letters          = map_rows(f'{store}.letters', '<u8', (len(sentences), language.words))
+      words            = map_rows(f'{store}.words',   '<u4', (int(np.sum(counts)),))
+
+   corpus              = Corpus(sentences, counts, letters, language, features, key=key, words=words)
+
+   if cache:
+      print(f'Saving corpus data into cache {cacheFile(file)}...')
+      state['fingerprint'] = fingerprint(file, state['offset'])
+      state['provisional'] = provisional
+      state['vocabulary']  = list(vocabulary)
+      saveCache(file, key, corpus, resume=state)
+
+   if progress is not None:
+      progress(100)
+
+   return corpus
@@ -0,0 +1,505 @@
+# Indexes built once per corpus to draw sentences quickly
+# Mercier Wilfried - IRAP
+
+import random
+import numpy  as np
+from   typing import Optional, Any
+
+def numpyGenerator(rng: Any = None) -> np.random.Generator:
+    r'''
+    Numpy random number generator matching a given generator or seed.
+    
+    :param rng: (**Optional**) numpy generator, returned as is, random.Random instance or random module, from which a seed is drawn, or seed. If None, the generator is seeded from the system.
+    
+    :returns: numpy generator
+    :rtype: numpy.random.Generator
+    '''
+    
+    if rng is random or isinstance(rng, random.Random):
+        rng = rng.getrandbits(64)
+        
+    return np.random.default_rng(rng)
+
+def popcount(bitmap: np.ndarray) -> np.ndarray:
+    r'''
+    Number of bits set in each integer of a bitmap.
+    
+    :param ndarray[uint64] bitmap: bitmap
+    
+    :returns: number of bits set
+    :rtype: ndarray[int]
+    '''
+    
+    bitmap = np.asarray(bitmap, dtype=np.uint64)
+    
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bitmap)
+    
+    return np.unpackbits(np.ascontiguousarray(bitmap).view(np.uint8)).reshape(bitmap.shape + (64,)).sum(axis=-1)
+
+class WordCountIndex:
+    r'''Index of the sentences of a corpus grouped by their number of words.'''
+    
+    def __init__(self, counts, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+        
+        :param counts: number of words of each sentence of the corpus
+        :type counts: list[int] or ndarray[int]
+        '''
+        
+        #: Number of words of each sentence
+        self.counts  = np.asarray(counts, dtype=np.int32)
+        
+        #: Sentence positions sorted by number of words
+        self.order   = np.argsort(self.counts, kind='stable').astype(np.int32)
+        
+        #: Prefix sum of the number of sentences: offsets[n] is the number of sentences with less than n words
+        self.offsets = np.zeros(1, dtype=np.int64)
+        if len(self.counts) > 0:
+            self.offsets = np.concatenate((self.offsets, np.cumsum(np.bincount(self.counts))))
+        
+    def __len__(self) -> int:
+        r'''Number of sentences in the index.'''
+        
+        return len(self.counts)
+        
+    def bounds(self, minWords: int, maxWords: int) -> tuple[int, int]:
+        r'''
+        Range of positions in the order array of the sentences with a number of words between minWords and maxWords (included).
+        
+        :param int minWords: minimum number of words
+        :param int maxWords: maximum number of words
+        
+        :returns: first position and last position (excluded)
+        :rtype: int, int
+        '''
+        
+        last = len(self.offsets) - 1
+        low  = int(self.offsets[min(max(minWords, 0), last)])
+        high = int(self.offsets[min(max(maxWords+1, 0), last)])
+        
+        return low, max(low, high)
+    
+    def draw(self, minWords: int, maxWords: int, rng: Any = random, *args, **kwargs) -> Optional[int]:
+        r'''
+        Draw uniformly the position of a sentence with a number of words between minWords and maxWords (included).
+        
+        :param int minWords: minimum number of words
+        :param int maxWords: maximum number of words
+        
+        :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+        
+        :returns: position of the sentence in the corpus or None if no sentence has a number of words in this range
+        :rtype: int or None
+        '''
+        
+        low, high = self.bounds(minWords, maxWords)
+        
+        if low == high:
+            return None
+        
+        return int(self.order[rng.randrange(low, high)])
+    
+    def sample(self, n: int, minWords: int, maxWords: int, replace: bool = True, rng: Any = None, *args, **kwargs) -> np.ndarray:
+        r'''
+        Draw uniformly the positions of n sentences with a number of words between minWords and maxWords (included) in a single vectorized step.
+        
+        :param int n: number of sentences to draw
+        :param int minWords: minimum number of words
+        :param int maxWords: maximum number of words
+        
+        :param bool replace: (**Optional**) whether the same sentence can be drawn several times or not
+        :param rng: (**Optional**) random number generator or seed. See numpyGenerator.
+        
+        :returns: positions of the sentences in the corpus
+        :rtype: ndarray[int]
+        
+        :raises ValueError: if no sentence has a number of words in this range, or if replace is False and less than n sentences have a number of words in this range
+        '''
+        
+        low, high = self.bounds(minWords, maxWords)
+        
+        if low == high and n > 0:
+            raise ValueError(f'No sentence with {minWords} to {maxWords} words.')
+            
+        if not replace and high - low < n:
+            raise ValueError(f'Cannot draw {n} different sentences among the {high - low} sentences with {minWords} to {maxWords} words.')
+        
+        return self.order[low + numpyGenerator(rng).choice(high - low, size=n, replace=replace)].astype(np.int64)
+
+
+class FeatureIndex:
+    r'''
+    Index of the sentences of a corpus by several features (number of words, number of characters, etc.), used to draw a sentence satisfying a range filter on each of these features.
+    
+    The values of each feature are split into buckets and, for each bucket, a bitmap of the sentences whose value is in this bucket or a lower one is built. A range filter is then the difference of two bitmaps and a conjunction of filters the AND of their bitmaps. Sentences of the buckets at the edges of a range are checked individually since only part of them may be in the range.
+    '''
+    
+    #: Maximum number of buckets per feature
+    BUCKETS  = 32
+    
+    #: Number of draws among the candidate sentences before computing the exact bitmap
+    ATTEMPTS = 16
+    
+    def __init__(self, columns: dict, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+        
+        :param dict columns: value of each feature for each sentence of the corpus, as arrays with the same length
+        '''
+        
+        #: Value of each feature for each sentence
+        self.columns = {name: np.asarray(values) for name, values in columns.items()}
+        
+        #: Number of sentences
+        self.size    = len(next(iter(self.columns.values()))) if self.columns else 0
+        
+        # Bitmap of all the sentences, with bits beyond the last sentence unset
+        self.all     = self._pack(np.ones(self.size, dtype=bool))
+        
+        #: Lowest value of each bucket of each feature
+        self.edges   = {}
+        
+        #: Highest value of each bucket of each feature
+        self.maxima  = {}
+        
+        #: Cumulative bitmaps of each feature: bitmaps[name][b] has the bits of the sentences in buckets 0 to b set
+        self.bitmaps = {}
+        
+        for name, values in self.columns.items():
+            unique               = np.unique(values)
+            
+            # Integer features with few values get one bucket per value, others are split into buckets with similar numbers of sentences
+            if len(unique) <= self.BUCKETS:
+                edges            = unique
+            else:
+                edges            = np.unique(np.quantile(values, np.linspace(0, 1, self.BUCKETS, endpoint=False), method='inverted_cdf'))
+            
+            buckets              = np.searchsorted(edges, values, side='right') - 1
+            maxima               = edges.copy()
+            np.maximum.at(maxima, buckets, values)
+            
+            bitmaps              = np.empty((len(edges), len(self.all)), dtype=np.uint64)
+            current              = np.zeros(len(self.all), dtype=np.uint64)
+            
+            for bucket in range(len(edges)):
+                current          = current | self._pack(buckets == bucket)
+                bitmaps[bucket]  = current
+                
+            self.edges[name]     = edges
+            self.maxima[name]    = maxima
+            self.bitmaps[name]   = bitmaps
+    
+    def __len__(self) -> int:
+        r'''Number of sentences in the index.'''
+        
+        return self.size
+    
+    @staticmethod
+    def _pack(mask: np.ndarray) -> np.ndarray:
+        r'''
+        Pack a boolean mask into a bitmap of 64 bits integers. Bit i of integer j corresponds to position 64*j + i.
+        
+        :param ndarray[bool] mask: mask to pack
+        
+        :returns: bitmap
+        :rtype: ndarray[uint64]
+        '''
+        
+        packed = np.packbits(mask, bitorder='little')
+        packed = np.concatenate((packed, np.zeros(-len(packed) % 8, dtype=np.uint8)))
+        
+        return packed.view('<u8').astype(np.uint64)
+    
+    @staticmethod
+    def _popcount(bitmap: np.ndarray) -> np.ndarray:
+        r'''
+        Number of bits set in each integer of a bitmap.
+        
+        :param ndarray[uint64] bitmap: bitmap
+        
+        :returns: number of bits set
+        :rtype: ndarray[int]
+        '''
+        
+        return popcount(bitmap)
+    
+    def candidates(self, filters: dict) -> tuple[np.ndarray, dict]:
+        r'''
+        Bitmap of the sentences in the buckets covered by all the filters. It holds every sentence satisfying the filters, but also the sentences of the edge buckets which are out of the range.
+        
+        :param dict filters: range of values (minimum, maximum), both included, for some features. None can be used for an unbounded side.
+        
+        :returns: bitmap of the candidate sentences and the filters whose edge buckets are only partly in the range, with their bounds
+        :rtype: ndarray[uint64], dict
+        
+        :raises KeyError: if a filter is given for a feature which is not in the index
+        '''
+        
+        result          = self.all.copy()
+        partial         = {}
+        
+        for name, (low, high) in filters.items():
+            edges       = self.edges[name]
+            bitmaps     = self.bitmaps[name]
+            
+            low         = edges[0]                 if low  is None else low
+            high        = self.maxima[name][-1]    if high is None else high
+            
+            # Buckets containing the bounds of the range
+            first       = max(int(np.searchsorted(edges, low, side='right')) - 1, 0)
+            last        = int(np.searchsorted(edges, high, side='right')) - 1
+            
+            if last < 0 or low > high:
+                return np.zeros_like(result), {}
+            
+            result     &= bitmaps[last]
+            if first > 0:
+                result &= ~bitmaps[first-1]
+            
+            if edges[first] < low or self.maxima[name][last] > high:
+                partial[name] = (low, high)
+                
+        return result, partial
+    
+    def satisfies(self, positions: np.ndarray, filters: dict) -> np.ndarray:
+        r'''
+        Check individually whether sentences satisfy the filters.
+        
+        :param ndarray[int] positions: positions of the sentences
+        :param dict filters: range of values (minimum, maximum), both included, for some features
+        
+        :returns: whether each sentence satisfies all the filters
+        :rtype: ndarray[bool]
+        '''
+        
+        keep       = np.ones(len(positions), dtype=bool)
+        for name, (low, high) in filters.items():
+            values = self.columns[name][positions]
+            keep  &= (values >= low) & (values <= high)
+            
+        return keep
+    
+    def match(self, filters: dict) -> np.ndarray:
+        r'''
+        Bitmap of the sentences satisfying all the filters.
+        
+        :param dict filters: range of values (minimum, maximum), both included, for some features. None can be used for an unbounded side.
+        
+        :returns: bitmap of the matching sentences
+        :rtype: ndarray[uint64]
+        
+        :raises KeyError: if a filter is given for a feature which is not in the index
+        '''
+        
+        result, partial = self.candidates(filters)
+        
+        # Sentences of the edge buckets are checked once all the bitmaps are combined, since they are then few
+        if partial:
+            positions   = self.positions(result)
+            outside     = positions[~self.satisfies(positions, partial)]
+            np.bitwise_and.at(result, outside // 64, ~(np.uint64(1) << (outside % 64).astype(np.uint64)))
+                    
+        return result
+    
+    def positions(self, bitmap: np.ndarray) -> np.ndarray:
+        r'''
+        Positions of the bits set in a bitmap.
+        
+        :param ndarray[uint64] bitmap: bitmap
+        
+        :returns: positions
+        :rtype: ndarray[int]
+        '''
+        
+        # Only integers with bits set are unpacked
+        words      = np.flatnonzero(bitmap)
+        bits       = np.unpackbits(bitmap[words].view(np.uint8), bitorder='little').reshape(-1, 64)
+        rows, cols = np.nonzero(bits)
+        
+        return 64*words[rows] + cols
+    
+    def count(self, filters: dict) -> int:
+        r'''
+        Number of sentences satisfying all the filters. See match.
+        
+        :param dict filters: range of values (minimum, maximum) for some features
+        
+        :returns: number of sentences
+        :rtype: int
+        '''
+        
+        return int(self._popcount(self.match(filters)).sum())
+    
+    def draw(self, filters: dict, rng: Any = random, *args, **kwargs) -> Optional[int]:
+        r'''
+        Draw uniformly the position of a sentence satisfying all the filters. See match.
+        
+        A few sentences are first drawn among the candidates and the first one satisfying the filters is kept, which avoids checking every sentence of the edge buckets. This is still uniform over the matching sentences. The exact bitmap is only computed if all these draws fail.
+        
+        :param dict filters: range of values (minimum, maximum) for some features
+        
+        :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+        
+        :returns: position of the sentence in the corpus or None if no sentence satisfies the filters
+        :rtype: int or None
+        '''
+        
+        bitmap, partial = self.candidates(filters)
+        cumulated       = np.cumsum(self._popcount(bitmap))
+        
+        if len(cumulated) == 0 or cumulated[-1] == 0:
+            return None
+        
+        if not partial:
+            return self._nth(bitmap, cumulated, rng.randrange(int(cumulated[-1])))
+        
+        for _ in range(self.ATTEMPTS):
+            position    = self._nth(bitmap, cumulated, rng.randrange(int(cumulated[-1])))
+            if self.satisfies(np.array([position]), partial)[0]:
+                return position
+        
+        bitmap          = self.match(filters)
+        cumulated       = np.cumsum(self._popcount(bitmap))
+        
+        if cumulated[-1] == 0:
+            return None
+        
+        return self._nth(bitmap, cumulated, rng.randrange(int(cumulated[-1])))
+    
+    @staticmethod
+    def _nth(bitmap: np.ndarray, cumulated: np.ndarray, k: int) -> int:
+        r'''
+        Position of the k-th bit set in a bitmap.
+        
+        :param ndarray[uint64] bitmap: bitmap
+        :param ndarray[int] cumulated: cumulative sum of the number of bits set in the integers of the bitmap
+        :param int k: rank of the bit, starting at 0
+        
+        :returns: position of the bit
+        :rtype: int
+        '''
+        
+        # Find the integer holding the k-th bit set, then the bit itself
+        word  = int(np.searchsorted(cumulated, k, side='right'))
+        k    -= int(cumulated[word-1]) if word > 0 else 0
+        bits  = np.flatnonzero(np.unpackbits(bitmap[word:word+1].view(np.uint8), bitorder='little'))
+        
+        return 64*word + int(bits[k])
+
+
+class NoRepeatSampler:
+    r'''
+    Sampler drawing the sentences of a WordCountIndex without repetition until all the sentences with the requested number of words were drawn.
+    
+    Drawn sentences are marked in a bitset with one bit per sentence of the corpus. Sentences are visited in the order of a random permutation of the eligible ones, computed on the fly with a Feistel network, so that no list of positions is ever built and each draw takes a constant time on average. Once all the eligible sentences were drawn, their bits are cleared and a new permutation is used.
+    '''
+    
+    #: Number of rounds of the Feistel network
+    ROUNDS = 4
+    
+    def __init__(self, index: WordCountIndex, seen: Optional[bytes] = None, walk: Optional[dict] = None, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+        
+        :param WordCountIndex index: index of the sentences
+        
+        :param bytes seen: (**Optional**) bitset of the sentences already drawn, as saved by a previous sampler. See state.
+        :param dict walk: (**Optional**) permutation being visited, as saved by a previous sampler. See state.
+        '''
+        
+        self.index = index
+        
+        #: Bitset of the sentences already drawn: bit i % 8 of byte i // 8 is set if sentence i was drawn
+        self.seen  = bytearray(seen) if seen is not None else bytearray((len(index) + 7) // 8)
+        
+        #: Permutation being visited: range of positions in the order array of the index ('bounds'), key of the permutation ('key') and rank of the next position to visit ('next')
+        self.walk  = dict(walk) if walk is not None else None
+        
+    def __len__(self) -> int:
+        r'''Number of sentences already drawn.'''
+        
+        return sum(bin(byte).count('1') for byte in self.seen)
+    
+    def state(self) -> dict:
+        r'''
+        State of the sampler, used to create a new sampler which continues where this one stopped.
+        
+        :returns: bitset of the drawn sentences ('seen') and permutation being visited ('walk')
+        :rtype: dict
+        '''
+        
+        return {'seen' : bytes(self.seen),
+                'walk' : self.walk
+               }
+    
+    def _permute(self, rank: int, size: int, key: int) -> int:
+        r'''
+        Position of a given rank in a random permutation of range(size). The permutation is a Feistel network over the smallest power of 4 not lower than size, with positions out of range skipped (cycle walking).
+        
+        :param int rank: rank in the permutation
+        :param int size: number of elements of the permutation
+        :param int key: key of the permutation
+        
+        :returns: position
+        :rtype: int
+        '''
+        
+        half         = max((size - 1).bit_length() + 1, 2) // 2
+        mask         = (1 << half) - 1
+        position     = rank
+        
+        while True:
+            left     = position >> half
+            right    = position &  mask
+            
+            for step in range(self.ROUNDS):
+                
+                # Round function mixing the right half with the key, similar to splitmix64
+                mixed       = (right + key + step * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+                mixed       = ((mixed ^ (mixed >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+                mixed       = ((mixed ^ (mixed >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+                left, right = right, left ^ ((mixed ^ (mixed >> 31)) & mask)
+                
+            position = (left << half) | right
+            
+            if position < size:
+                return position
+    
+    def draw(self, minWords: int, maxWords: int, rng: Any = random, *args, **kwargs) -> Optional[int]:
+        r'''
+        Draw the position of a sentence with a number of words between minWords and maxWords (included) which was not drawn yet. If all these sentences were already drawn, they can be drawn again.
+        
+        :param int minWords: minimum number of words
+        :param int maxWords: maximum number of words
+        
+        :param rng: (**Optional**) random number generator used to choose the permutations. It can be a random.Random instance or the random module.
+        
+        :returns: position of the sentence in the corpus or None if no sentence has a number of words in this range
+        :rtype: int or None
+        '''
+        
+        low, high             = self.index.bounds(minWords, maxWords)
+        
+        if low == high:
+            return None
+        
+        if self.walk is None or self.walk['bounds'] != (low, high):
+            self.walk         = {'bounds': (low, high), 'key': rng.getrandbits(64), 'next': 0}
+        
+        # Sentences drawn while other bounds were used are skipped
+        while self.walk['next'] < high - low:
+            position          = int(self.index.order[low + self._permute(self.walk['next'], high - low, self.walk['key'])])
+            self.walk['next']+= 1
+            
+            if not self.seen[position >> 3] & (1 << (position & 7)):
+                self.seen[position >> 3] |= 1 << (position & 7)
+                return position
+        
+        # All the sentences in range were drawn, so they are available again
+        for position in self.index.order[low:high]:
+            self.seen[position >> 3] &= ~(1 << (position & 7)) & 0xFF
+            
+        self.walk             = None
+        return self.draw(minWords, maxWords, rng=rng)
@@ -0,0 +1,322 @@
+# Alphabet of a language compiled into lookup tables
+# Mercier Wilfried - IRAP
+
+import os
+import yaml
+import pickle
+import numpy     as np
+import os.path   as opath
+from   functools import lru_cache
+
+# Custom imports
+from   backend.store import replacing
+
+#: Class of the letters in the lookup table of a language
+VOWEL        = 1
+CONSONANT    = 2
+
+#: Version of the language pack format. It must be increased each time the content of the packs changes.
+PACK_VERSION = 1
+
+class Language(dict):
+    r'''
+    Alphabet of a language. It is a read-only dictionary with the following keys, for compatibility with the dictionaries used before:
+
+        - vowels: vowels of the language
+        - consonants: consonants of the language
+        - map_alternate: letter each alternate form is mapped to
+        - map_alternate_inv: alternate forms of each letter
+
+    Lookup tables are built once so that classifying a character only requires a dictionary lookup. Since a language cannot be modified, it can be shared without being copied.
+    '''
+
+    def __init__(self, vowels: list[str], consonants: list[str], alterations: dict = {}, alt: bool = True, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param list[str] vowels: vowels of the language, without their alternate forms
+        :param list[str] consonants: consonants of the language, without their alternate forms
+
+        :param dict alterations: (**Optional**) alternate forms of some letters
+        :param bool alt: (**Optional**) whether alternate forms are mapped to their letter (True) or considered as independent letters (False)
+        '''
+
+        vowels              = list(vowels)
+        consonants          = list(consonants)
+        alterations         = {letter: tuple(forms) for letter, forms in alterations.items()}
+
+        # If we consider alternations, alternated forms must not appear in the vowel and consonant lists, but we must keep track by mapping them to their parent form
+        if alt:
+            mapAlternate    = {form: letter for letter, forms in alterations.items() for form in forms}
+            mapAlternateInv = alterations
+
+        # If we do not consider alternations, then alternated forms are considered as different characters and must be included into the vowel and consonant lists
+        else:
+            mapAlternate    = {}
+            mapAlternateInv = {}
+
+            for letter, forms in alterations.items():
+                if letter in consonants:
+                    consonants += forms
+                elif letter in vowels:
+                    vowels     += forms
+                else:
+                    print(f'Alterations {forms} of letter {letter} could not be broadcast to neither consonants, nor vowels.')
+
+        super().__init__(vowels            = tuple(vowels),
+                         consonants        = tuple(consonants),
+                         map_alternate     = mapAlternate,
+                         map_alternate_inv = mapAlternateInv)
+
+        # Languages are hashed from their content, consistently with dictionary equality, so that they can be used as cache keys
+        self._hash         = self._contentHash()
+
+        #: Whether alternate forms are mapped to their letter or not
+        self.alt           = alt
+
+        #: Vowels and consonants, as sets
+        self.vowelSet      = frozenset(self['vowels'])
+        self.consonantSet  = frozenset(self['consonants'])
+
+        #: Class (VOWEL or CONSONANT) and letter of each character of the alphabet, including alternate forms which are mapped to their letter
+        self.table         = {}
+
+        for consonant in self['consonants']:
+            self.table[consonant] = (CONSONANT, consonant)
+
+        for vowel in self['vowels']:
+            self.table.setdefault(vowel, (VOWEL, vowel))
+
+        for form, letter in mapAlternate.items():
+            if form in self.table:
+                continue
+
+            if letter in self.vowelSet:
+                self.table[form] = (VOWEL, letter)
+            elif letter in self.consonantSet:
+                self.table[form] = (CONSONANT, letter)
+
+        #: Letter and its alternate forms for each letter of the alphabet
+        self.forms         = {letter: (letter,) + mapAlternateInv.get(letter, ()) for letter in self['vowels'] + self['consonants']}
+
+        #: Letters of the alphabet in the order of the bits of the letter masks. See mask.
+        self.letters       = tuple(dict.fromkeys(letter for kind, letter in self.table.values()))
+
+        #: Number of 64 bits integers in a letter mask
+        self.words         = max((len(self.letters) + 63) // 64, 1)
+
+        position           = {letter: pos for pos, letter in enumerate(self.letters)}
+
+        #: Position in the letter masks of the letter each character of the alphabet is mapped to, indexed by code point. Other characters have -1.
+        self.lookup        = np.full(max(map(ord, self.table), default=-1) + 1, -1, dtype=np.int16)
+        for char, (kind, letter) in self.table.items():
+            self.lookup[ord(char)] = position[letter]
+
+        #: Precomputed translation tables for pairs of letters (letter out, letter in). See compileTranslations.
+        self.translations  = {}
+
+        #: Letter masks of all the vowels and of all the consonants
+        self.vowelMask     = self.mask(letter for letter in self.letters if self.table[letter][0] == VOWEL)
+        self.consonantMask = self.mask(letter for letter in self.letters if self.table[letter][0] == CONSONANT)
+
+    def mask(self, letters) -> np.ndarray:
+        r'''
+        Letter mask of a set of letters: bit i % 64 of integer i // 64 is set if letter self.letters[i] is in the set.
+
+        :param letters: letters of the alphabet, or their alternate forms
+        :type letters: iterable[str]
+
+        :returns: letter mask
+        :rtype: ndarray[uint64]
+        '''
+
+        mask                 = np.zeros(self.words, dtype=np.uint64)
+        for letter in letters:
+            pos              = int(self.lookup[ord(letter)])
+            mask[pos // 64] |= np.uint64(1) << np.uint64(pos % 64)
+
+        return mask
+
+    def translationTable(self, letterOut: str, letterIn: str) -> dict:
+        r'''
+        Translation table replacing a letter and its alternate forms by another letter.
+
+        :param str letterOut: letter to replace
+        :param str letterIn: letter put instead
+
+        :returns: translation table to use with str.translate
+        :rtype: dict
+        '''
+
+        return str.maketrans(dict.fromkeys(self.forms.get(letterOut, (letterOut,)), letterIn))
+
+    def compileTranslations(self) -> None:
+        r'''Precompute the translation tables of all the pairs of vowels and of all the pairs of consonants, i.e. of all the changes made by the rules.'''
+
+        for letters in (self['vowels'], self['consonants']):
+            for letterOut in letters:
+                for letterIn in letters:
+                    self.translations[(letterOut, letterIn)] = self.translationTable(letterOut, letterIn)
+
+        return
+
+    def _contentHash(self) -> int:
+        return hash((self['vowels'], self['consonants'], tuple(sorted(self['map_alternate'].items()))))
+
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError('A Language cannot be modified.')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readOnly
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        return dict.__eq__(self, other)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo: dict):
+        return self
+
+    def __reduce__(self):
+        return (_restore, (dict(self), self.__dict__))
+
+def _restore(items: dict, state: dict) -> Language:
+   r'''
+   Rebuild a pickled Language from its items and attributes, without compiling it again.
+
+   :param dict items: dictionary items
+   :param dict state: attributes
+
+   :returns: language
+   :rtype: Language
+   '''
+
+   language                 = Language.__new__(Language)
+   dict.update(language, items)
+   language.__dict__.update(state)
+
+   # Hashes of strings differ between processes
+   language._hash           = language._contentHash()
+
+   return language
+
+def as_language(language: dict) -> Language:
+   r'''
+   Compile a dictionary describing a language into a Language. Languages are returned as is, and dictionaries with the same content are only compiled once.
+
+   :param dict language: dictionary with vowels, consonants, and either map_alternate_inv or map_alternate keys
+
+   :returns: language
+   :rtype: Language
+   '''
+
+   if isinstance(language, Language):
+      return language
+
+   alterations = language.get('map_alternate_inv')
+   if alterations is None:
+      alterations = {}
+      for form, letter in language.get('map_alternate', {}).items():
+         alterations.setdefault(letter, []).append(form)
+
+   return _compile(tuple(language['vowels']), tuple(language['consonants']), tuple((letter, tuple(forms)) for letter, forms in alterations.items()))
+
+@lru_cache(maxsize=64)
+def _compile(vowels: tuple[str], consonants: tuple[str], alterations: tuple[tuple]) -> Language:
+   r'''Compile the content of a dictionary describing a language. See as_language.'''
+
+   return Language(vowels, consonants, dict(alterations), alt=True)
+
+
+#################################
+#         Language packs        #
+#################################
+
+def pack_file(file: str) -> str:
+   r'''
+   Name of the language pack compiled from a language file.
+
+   :param str file: language file
+
+   :returns: language pack file
+   :rtype: str
+   '''
+
+   return f'{opath.splitext(file)[0]}.pack'
+
+def pack_key(file: str) -> dict:
+   r'''
+   Key identifying the language file a pack was compiled from. If any of its values changes, the pack must be compiled again.
+
+   :param str file: language file
+
+   :returns: key
+   :rtype: dict
+   '''
+
+   stat = os.stat(file)
+   return {'version' : PACK_VERSION,
+           'size'    : stat.st_size,
+           'mtime'   : stat.st_mtime_ns
+          }
+
+def compile_pack(file: str) -> dict:
+   r'''
+   Compile a language file into the languages obtained with and without considering alternations, with their translation tables, and save them into the language pack.
+
+   :param str file: language file. It must be of YAML type.
+
+   :returns: languages with (True) and without (False) considering alternations
+   :rtype: dict[bool, Language]
+   '''
+
+   key           = pack_key(file)
+   with open(file, 'r') as f:
+      conf       = yaml.load(f, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+   languages     = {}
+   for alt in (True, False):
+      languages[alt] = Language(conf['vowels'], conf['consonants'], conf['alterations'], alt=alt)
+      languages[alt].compileTranslations()
+
+   # The pack is only an optimisation, so the language can still be used if it cannot be written
+   pack          = pack_file(file)
+   try:
+      with replacing(pack) as f:
+         pickle.dump(key, f)
+
+         # Each language is pickled separately so that only the one used is unpickled
+         pickle.dump({alt: pickle.dumps(language) for alt, language in languages.items()}, f)
+
+   except OSError as e:
+      print(f'Language pack {pack} could not be written ({e}).')
+
+   return languages
+
+def load_pack(file: str, alt: bool = True) -> Language:
+   r'''
+   Load a language from the pack compiled from a language file, compiling it first if it does not exist or if the language file changed since then.
+
+   :param str file: language file. It must be of YAML type.
+
+   :param bool alt: (**Optional**) whether to consider alternate forms as independent letters or not
+
+   :returns: language
+   :rtype: Language
+   '''
+
+   pack          = pack_file(file)
+   if opath.isfile(pack):
+      try:
+         with open(pack, 'rb') as f:
+
+            # The key is stored first so that stale packs are not loaded entirely
+            if pickle.load(f) == pack_key(file):
+               return pickle.loads(pickle.load(f)[alt])
+      except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, KeyError) as e:
+         print(f'Language pack {pack} could not be read ({e}).')
+
+   return compile_pack(file)[alt]
@@ -0,0 +1,70 @@
+# Loading of corpus files in a background thread
+# Mercier Wilfried - IRAP
+
+from   PyQt5.QtCore   import QThread, pyqtSignal
+
+# Custom imports
+from   backend.corpus import CorpusRegistry, LoadingCancelled
+
+class CorpusLoader(QThread):
+    r'''
+    Thread building the data of a corpus file so that the interface is not frozen meanwhile. The corpus is not added to the registry, this must be done by the slot connected to the loaded signal, in the main thread.
+    '''
+
+    #: Signal emitted with the percentage of the corpus processed so far
+    progress = pyqtSignal(int)
+
+    #: Signal emitted with the corpus file and its data once it is built
+    loaded   = pyqtSignal(str, object)
+
+    #: Signal emitted with the corpus file and an error message if building failed
+    failed   = pyqtSignal(str, str)
+
+    def __init__(self, registry: CorpusRegistry, file: str, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param CorpusRegistry registry: registry used to build the corpus data
+        :param str file: corpus file to load
+        '''
+
+        super().__init__(*args, **kwargs)
+
+        #: Corpus file to load
+        self.file       = file
+
+        self.registry   = registry
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        r'''Ask the thread to stop loading. No signal is emitted afterwards, except finished.'''
+
+        self._cancelled = True
+        return
+
+    def isCancelled(self) -> bool:
+        r'''
+        Whether loading was cancelled.
+
+        :returns: True if loading was cancelled, False otherwise
+        :rtype: bool
+        '''
+
+        return self._cancelled
+
+    def run(self) -> None:
+        r'''Build the corpus data.'''
+
+        try:
+            corpus = self.registry.build(self.file, progress=self.progress.emit, cancel=self.isCancelled)
+        except LoadingCancelled:
+            return
+        except (OSError, UnicodeDecodeError, LookupError) as e:
+            if not self._cancelled:
+                self.failed.emit(self.file, str(e))
+            return
+
+        if not self._cancelled:
+            self.loaded.emit(self.file, corpus)
+
+        return
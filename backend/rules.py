@@ -0,0 +1,225 @@
+# Registry of the rules modifying the sentences of the language groups
+# Mercier Wilfried - IRAP
+
+import random
+from   typing            import Optional, Callable, Any
+
+# Custom imports
+import backend.sentences as     sen
+import backend.batch     as     bat
+
+#: Checks that a sentence has what a rule needs to modify it, for each inventory name
+INVENTORIES = {'vowels'     : lambda sentence: len(sentence.vowelCounts) > 0,
+               'consonants' : lambda sentence: len(sentence.consonantCounts) > 0,
+               'letters'    : lambda sentence: len(sentence.vowelCounts) + len(sentence.consonantCounts) > 0,
+               'words'      : lambda sentence: any(sentence.isWord)
+              }
+
+class Rule:
+    r'''
+    A rule modifying sentences, with the widget enabling it in the interface and the messages describing its result in admin mode.
+
+    Rules are applied through their scalar function, which modifies a Sentence in place. A batched function, applied to the sentences of all the groups at once, can be registered as well for the rules which have one.
+    '''
+
+    def __init__(self, name: str, widget: str, function: Optional[Callable] = None, batch: Optional[Callable] = None, needs: tuple[str] = (), cost: float = 1,
+                 fields: tuple[str] = (), message: str = '', failure: str = '', *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param str name: name of the rule, as used in the configuration file
+        :param str widget: name of the checkbox enabling the rule in the interface
+
+        :param function: (**Optional**) function applying the rule to a Sentence, called as function(sentence, language, rng=rng). It must return a tuple whose first item is None if the sentence could not be modified. If None, the rule is not implemented.
+        :param batch: (**Optional**) function applying the rule to a SentenceBatch, called as batch(sentences, rng), where rng is a numpy random Generator. It must return a list with, for each group, the values returned by the function, or None if the sentence of the group could not be modified.
+        :param tuple[str] needs: (**Optional**) inventories a sentence must not have empty to be modified by the rule. See INVENTORIES.
+        :param float cost: (**Optional**) estimate of the time taken to apply the rule once to a sentence of about 15 words, in µs
+        :param tuple[str] fields: (**Optional**) names of the values returned by the function, used in the message
+        :param str message: (**Optional**) message describing a modification. It is formatted with the fields, the turn and the group.
+        :param str failure: (**Optional**) message used when the sentence could not be modified. It is formatted with the turn and the group.
+        '''
+
+        self.name     = name
+        self.widget   = widget
+        self.function = function
+        self.batch    = batch
+        self.needs    = needs
+        self.cost     = cost
+        self.fields   = fields
+        self.message  = message
+        self.failure  = failure
+
+    @property
+    def implemented(self) -> bool:
+        r'''Whether the rule can be applied or not.'''
+
+        return self.function is not None
+
+    def applicable(self, sentence: sen.Sentence) -> bool:
+        r'''
+        Whether a sentence has what the rule needs to modify it.
+
+        :param Sentence sentence: sentence
+
+        :returns: True if the rule may modify the sentence, False if it cannot
+        :rtype: bool
+        '''
+
+        return all(INVENTORIES[need](sentence) for need in self.needs)
+
+    def apply(self, sentence: sen.Sentence, language: dict, rng: Any = random, *args, **kwargs) -> Optional[tuple]:
+        r'''
+        Apply the rule to a sentence.
+
+        :param Sentence sentence: sentence to modify in place
+        :param Language language: alphabet of the language used
+
+        :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+
+        :returns: values returned by the function, or None if the sentence could not be modified
+        :rtype: tuple or None
+        '''
+
+        if not self.applicable(sentence):
+            return None
+
+        result = self.function(sentence, language, rng=rng)
+        return result if result[0] is not None else None
+
+    def applyBatch(self, sentences: bat.SentenceBatch, rng: Any, *args, **kwargs) -> list[Optional[tuple]]:
+        r'''
+        Apply the rule to the sentences of several groups at once.
+
+        :param SentenceBatch sentences: sentences to modify in place
+        :param numpy.random.Generator rng: random number generator
+
+        :returns: values returned by the batched function for each group, or None for the groups whose sentence could not be modified
+        :rtype: list
+        '''
+
+        # Sentences without tokens cannot be modified by any rule
+        if sentences.codes.shape[1] == 0:
+            return [None] * len(sentences)
+
+        return self.batch(sentences, rng)
+
+    def describe(self, result: Optional[tuple], turn: int, group: str) -> str:
+        r'''
+        Message describing the result of the rule.
+
+        :param result: values returned by apply
+        :type result: tuple or None
+        :param int turn: turn
+        :param str group: identifier of the group
+
+        :returns: message
+        :rtype: str
+        '''
+
+        if result is None:
+            return self.failure.format(turn=turn, group=group)
+
+        return self.message.format(turn=turn, group=group, **dict(zip(self.fields, result)))
+
+
+#: Registered rules
+RULES = {}
+
+def register(rule: Rule) -> Rule:
+   r'''
+   Register a rule, replacing any rule with the same name.
+
+   :param Rule rule: rule to register
+
+   :returns: rule
+   :rtype: Rule
+   '''
+
+   RULES[rule.name] = rule
+   return rule
+
+def implemented(names) -> list[str]:
+   r'''
+   Names of the implemented rules among some rule names, in the same order.
+
+   :param names: rule names
+   :type names: iterable[str]
+
+   :returns: names of the implemented rules
+   :rtype: list[str]
+   '''
+
+   return [name for name in names if name in RULES and RULES[name].implemented]
+
+def cost(names) -> float:
+   r'''
+   Estimate of the time taken to apply some rules one after the other to a sentence of about 15 words.
+
+   :param names: names of the rules applied
+   :type names: iterable[str]
+
+   :returns: estimated time in µs
+   :rtype: float
+   '''
+
+   return sum(RULES[name].cost for name in names)
+
+def widgets() -> list[str]:
+   r'''
+   Names of the checkboxes enabling the registered rules.
+
+   :returns: widget names
+   :rtype: list[str]
+   '''
+
+   return [rule.widget for rule in RULES.values()]
+
+
+#################################
+#         Rule functions        #
+#################################
+
+def _swap(sentence: sen.Sentence, language: dict, rng: Any = random, *args, **kwargs) -> tuple[Optional[str], Optional[str]]:
+   r'''Swap rule with the same signature as the other rules. See sentences.Swap.'''
+
+   return sen.Swap(sentence, rng=rng)
+
+register(Rule('VowtoVow_Single', 'rulesVow_Vow_S', function=sen.VowtoVow_Single, batch=bat.VowtoVow_Single, needs=('vowels',), cost=15,
+              fields  = ('word', 'vowel_out', 'vowel_in'),
+              message = 'Turn {turn}: {group} changed vowel {vowel_out} to vowel {vowel_in} in word {word}.',
+              failure = 'Turn {turn}: {group} made no modifications because no vowel was found in sentence.'))
+
+register(Rule('VowtoVow_All', 'rulesVow_Vow_A', function=sen.VowtoVow_All, batch=bat.VowtoVow_All, needs=('vowels',), cost=30,
+              fields  = ('vowel_out', 'vowel_in'),
+              message = 'Turn {turn}: {group} changed vowel {vowel_out} to vowel {vowel_in} in every word.',
+              failure = 'Turn {turn}: {group} made no modifications because no vowel was found in the sentence.'))
+
+register(Rule('ContoCon_Single', 'rulesCon_Con_S', function=sen.ContoCon_Single, batch=bat.ContoCon_Single, needs=('consonants',), cost=13,
+              fields  = ('word', 'consonant_out', 'consonant_in'),
+              message = 'Turn {turn}: {group} changed consonant {consonant_out} to consonant {consonant_in} in word {word}.',
+              failure = 'Turn {turn}: {group} made no modifications because no consonant was found in sentence.'))
+
+register(Rule('ContoCon_All', 'rulesCon_Con_A', function=sen.ContoCon_All, batch=bat.ContoCon_All, needs=('consonants',), cost=21,
+              fields  = ('consonant_out', 'consonant_in'),
+              message = 'Turn {turn}: {group} changed consonant {consonant_out} to consonant {consonant_in} in every word.',
+              failure = 'Turn {turn}: {group} made no modifications because no consonant was found in the sentence.'))
+
+register(Rule('LettoLet_Single', 'rulesLet_Let_S', function=sen.LettoLet_Single, batch=bat.LettoLet_Single, needs=('letters',), cost=20,
+              fields  = ('word', 'letter_out', 'letter_in'),
+              message = 'Turn {turn}: {group} changed letter {letter_out} to letter {letter_in} in word {word}.',
+              failure = 'Turn {turn}: {group} made no modifications because no letter was found in sentence.'))
+
+register(Rule('LettoLet_All', 'rulesLet_Let_A', function=sen.LettoLet_All, batch=bat.LettoLet_All, needs=('letters',), cost=37,
+              fields  = ('letter_out', 'letter_in'),
+              message = 'Turn {turn}: {group} changed letter {letter_out} to letter {letter_in} in every word.',
+              failure = 'Turn {turn}: {group} made no modifications because no letter was found in the sentence.'))
+
+register(Rule('Delete', 'rulesDel', function=sen.Delete, batch=bat.Delete, needs=('letters',), cost=18,
+              fields  = ('word', 'letter'),
+              message = 'Turn {turn}: {group} deleted letter {letter} in word {word}.',
+              failure = 'Turn {turn}: {group} made no modifications because no word had two different letters.'))
+
+register(Rule('Swap', 'rulesSwap', function=_swap, batch=bat.Swap, needs=('words',), cost=4,
+              fields  = ('word1', 'word2'),
+              message = 'Turn {turn}: {group} swaped word {word1} with word {word2}.',
+              failure = 'Turn {turn}: {group} made no modifications because no words could be swaped.'))
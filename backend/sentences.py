@@ -1,51 +1,333 @@
-import nltk
+import io
+import re
 import random
-import pickle
-import os.path as opath
-nltk.download('punkt')
+import numpy              as np
+import os.path            as opath
+from   collections        import deque
+from   concurrent.futures import ProcessPoolExecutor
+from   functools          import lru_cache
+from   itertools          import islice
+from   typing             import Optional
+
+import backend.tokenizer  as tokenizer
+from   backend.index      import WordCountIndex
+from   backend.language   import VOWEL, as_language
 
 #################################################################################
 #         Extracting sentences, words, consonants, vowels and syllables         #
 #################################################################################
 
-def make_sentences(file: str, language: str = 'French') -> list[str]:
+def load_nltk():
+   '''
+   Import nltk. Importing it takes a significant fraction of the startup time, so it is only done the first time a tokenizer is needed.
+
+   :returns: nltk module
+   :rtype: module
+   '''
+
+   import nltk
+   return nltk
+
+def nltk_word_tokenize(sentence: str) -> list[str]:
+   '''
+   Split a sentence into words with nltk.word_tokenize. nltk first splits the sentence again with its English sentence splitter, and then splits each part into words like the regex tokenizer, the period ending each part being split from the word before it.
+
+   :param str sentence: sentence to split
+
+   :returns: words
+   :rtype: list[str]
+   '''
+
+   return load_nltk().word_tokenize(sentence)
+
+#: Word tokenizers which can be used by make_words. They give the same words, except when nltk splits the sentence again (see nltk_word_tokenize).
+WORD_TOKENIZERS = {'regex' : tokenizer.word_tokenize,
+                   'nltk'  : nltk_word_tokenize
+                  }
+
+#: Name of the word tokenizer used by make_words
+word_tokenizer  = 'regex'
+
+def set_word_tokenizer(name: str) -> None:
+   '''
+   Set the word tokenizer used by make_words.
+
+   :param str name: name of the tokenizer. Must be a key of WORD_TOKENIZERS.
+
+   :raises ValueError: if the tokenizer does not exist
+   '''
+
+   global word_tokenizer
+
+   if name not in WORD_TOKENIZERS:
+      raise ValueError(f'Word tokenizer {name} does not exist. Available tokenizers are {list(WORD_TOKENIZERS.keys())}.')
+
+   word_tokenizer = name
+   return
+
+@lru_cache(maxsize=None)
+def load_detector(language: str = 'French'):
+   '''
+   Load the punkt sentence tokenizer of a given language. It is only loaded once per process and punkt data are only downloaded if they cannot be found locally.
+
+   :param str language: (**Optional**) language of the text. Must be recognised by nltk.tokenize.punkt module.
+
+   :returns: sentence tokenizer
+   :rtype: nltk.tokenize.punkt.PunktSentenceTokenizer
+   '''
+
+   nltk     = load_nltk()
+   resource = opath.join('tokenizers', 'punkt', f'{language.lower()}.pickle')
+
+   try:
+      nltk.data.find(resource)
+   except LookupError:
+      print('Punkt data not found locally, downloading them...')
+      nltk.download('punkt')
+
+   return nltk.data.load(resource)
+
+def iter_sentences(file: str, language: str = 'French', chunkSize: int = 1048576, workers: int = 1, offset: int = 0, carry: str = '', state: Optional[dict] = None):
+   '''
+   Extract sentences out of a corpus file, reading it by chunks so that memory usage does not depend on the size of the corpus.
+
+   Tokenization can be resumed after text was appended to the file by giving back the **offset** and **carry** values stored in **state** by a previous call. The last **state['provisional']** sentences yielded by the previous call must then be discarded since they are yielded again.
+
+   :param str file: file from which the sentences are extracted
+
+   :param str carry: (**Optional**) text preceding the position **offset** in the file which must be tokenized again
+   :param int chunkSize: (**Optional**) number of characters read from the file at each iteration
+   :param str language: (**Optional**) language of the text. Must be recognised by nltk.tokenize.punkt module.
+   :param int offset: (**Optional**) position in bytes where to start reading the file
+   :param dict state: (**Optional**) dictionary filled, once the whole file is read, with the position in bytes of the end of the file ('offset'), the text of the last sentences which may change if text is appended to the file ('carry') and their number ('provisional')
+   :param int workers: (**Optional**) number of processes used to tokenize the text. If larger than 1, chunks are split at paragraph boundaries and tokenized in parallel. Resuming tokenization is always done with a single process.
+
+   :returns: generator yielding sentences one by one
+   :rtype: generator[str]
+   '''
+
+   if workers > 1 and offset == 0 and carry == '':
+      yield from iter_sentences_parallel(file, language=language, chunkSize=chunkSize, workers=workers, state=state)
+      return
+
+   detector      = load_detector(language)
+
+   # Carry is the last sentence of the previous chunk which may continue in the next one
+   # Pending is the hyphen at the end of the previous chunk which may be followed by a line break
+   pending       = ''
+   if carry.endswith('-'):
+      carry      = carry[:-1]
+      pending    = '-'
+
+   with open(file, 'rb') as raw, io.TextIOWrapper(raw) as f:
+      raw.seek(offset)
+
+      while True:
+         chunk   = f.read(chunkSize)
+         last    = len(chunk) == 0
+         text    = pending + chunk
+         pending = ''
+
+         # A trailing hyphen can only be dealt with once we know the next character
+         if not last and text.endswith('-'):
+            pending = '-'
+            text    = text[:-1]
+
+         text    = carry + text.replace('-\n', '').replace('\n', ' ')
+         spans   = list(detector.span_tokenize(text))
+
+         if last:
+            if state is not None:
+               state.update(offset=raw.tell(), carry=text, provisional=len(spans))
+
+            for start, end in spans:
+               yield text[start:end]
+            break
+
+         # The last sentence may be incomplete and the boundary before it depends on its first token, so both are tokenized again with the next chunk
+         for start, end in spans[:-2]:
+            yield text[start:end]
+
+         carry   = text[spans[-2][0]:] if len(spans) > 1 else text
+
+def iter_paragraphs(file: str, chunkSize: int = 1048576, state: Optional[dict] = None):
+   '''
+   Read a corpus file by chunks ending at paragraph boundaries, i.e. after an empty line, and join lines the same way as in iter_sentences.
+
+   :param str file: file to read
+
+   :param int chunkSize: (**Optional**) minimum number of characters read for each chunk (except the last one)
+   :param dict state: (**Optional**) dictionary filled with the position in bytes of the end of the file ('offset') once the whole file is read
+
+   :returns: generator yielding chunks of text
+   :rtype: generator[str]
+   '''
+
+   with open(file, 'rb') as raw, io.TextIOWrapper(raw) as f:
+      while True:
+         chunk    = f.read(chunkSize)
+         if len(chunk) == 0:
+            if state is not None:
+               state['offset'] = raw.tell()
+            break
+
+         # Complete the chunk up to the end of the current paragraph
+         if not chunk.endswith('\n\n'):
+            while True:
+               line   = f.readline()
+               chunk += line
+
+               if line.strip() == '':
+                  break
+
+         yield chunk.replace('-\n', '').replace('\n', ' ')
+
+def _span_chunk(text: str, language: str) -> list[tuple[int, int]]:
+   '''Tokenize a chunk of text in a worker process. See iter_sentences_parallel.'''
+
+   return list(load_detector(language).span_tokenize(text))
+
+def iter_sentences_parallel(file: str, language: str = 'French', chunkSize: int = 1048576, workers: int = 2, state: Optional[dict] = None):
+   '''
+   Extract sentences out of a corpus file by tokenizing chunks of paragraphs in a pool of processes. Sentences are yielded in the same order and are the same as with iter_sentences.
+
+   :param str file: file from which the sentences are extracted
+
+   :param int chunkSize: (**Optional**) minimum number of characters sent to a process at once
+   :param str language: (**Optional**) language of the text. Must be recognised by nltk.tokenize.punkt module.
+   :param dict state: (**Optional**) dictionary filled once the whole file is read. See iter_sentences.
+   :param int workers: (**Optional**) number of processes
+
+   :returns: generator yielding sentences one by one
+   :rtype: generator[str]
+   '''
+
+   detector          = load_detector(language)
+   chunks            = iter_paragraphs(file, chunkSize=chunkSize, state=state)
+   carry             = '' # Last sentence of the previous chunk which may continue in the next one
+
+   with ProcessPoolExecutor(max_workers=workers) as pool:
+
+      # Only a few chunks are in flight at the same time to keep memory usage bounded
+      queue          = deque()
+      for text in islice(chunks, 2*workers):
+         queue.append((text, pool.submit(_span_chunk, text, language)))
+
+      while len(queue) > 0:
+         text, future = queue.popleft()
+         spans        = future.result()
+
+         for text_next in islice(chunks, 1):
+            queue.append((text_next, pool.submit(_span_chunk, text_next, language)))
+
+         # Tokenize again the sentences overlapping two chunks until a boundary agrees with one found within the chunk
+         if carry.strip() != '':
+            for k in range(1, len(spans)):
+               seam   = carry + text[:spans[k][1]]
+               seams  = list(detector.span_tokenize(seam))
+               ends   = [end for start, end in seams]
+               cut    = len(carry) + spans[k-1][1]
+
+               if cut in ends:
+                  for start, end in seams[:ends.index(cut)+1]:
+                     yield seam[start:end]
+
+                  carry = ''
+                  spans = spans[k:]
+                  break
+
+            else:
+               carry += text
+               continue
+
+         # As in iter_sentences, the last two sentences are tokenized again with the next chunk
+         for start, end in spans[:-2]:
+            yield text[start:end]
+
+         if len(spans) > 0:
+            carry     = text[spans[max(len(spans)-2, 0)][0]:]
+         else:
+            carry    += text
+
+   spans             = list(detector.span_tokenize(carry))
+   if state is not None:
+      state.update(carry=carry, provisional=len(spans))
+
+   for start, end in spans:
+      yield carry[start:end]
+
+def make_sentences(file: str, language: str = 'French', workers: int = 1) -> list[str]:
    '''
    Extract sentences out of a corpus file.
 
    :param str file: file from which the sentences are extracted
    
    :param str language: (**Optional**) language of the text. Must be recognised by nltk.tokenize.punkt module.
+   :param int workers: (**Optional**) number of processes used to tokenize the text
 
    :returns: list of sentences
    :rtype: list[str]
    '''
-      
-   detector    = nltk.data.load(opath.join('tokenizers', 'punkt', f'{language.lower()}.pickle'))
-   sentences   = []
    
-   # Check that there is not already a pickled object there to avoid generating the sentences again
-   path, fname = opath.split(file)
-   pickled     = opath.join(path, f'{fname.rsplit(".txt", maxsplit=1)[0]}.pickle')
-   if opath.exists(pickled):
-      print(f'Loading pickled object {pickled}...')
-      with open(pickled, 'rb') as f:
-         return pickle.load(f)
-   else:
-      with open(file, 'r') as f:
-         text  = f.read().replace('-\n', '').replace('\n', ' ')
-      
-   print(f'Tokenizing text with {len(text)} characters...')
-   sentences   = detector.tokenize(text[:3000000])
+   print(f'Tokenizing text from {file} with {workers} process(es)...')
+   sentences   = list(iter_sentences(file, language=language, workers=workers))
    print(f'{len(sentences)} sentences created.')
-   
-   print('Pickling for later usage...')
-   with open(pickled, 'wb') as f:
-      pickle.dump(sentences, f)
 
    return sentences
 
 
-def make_words(sentence, exclude=[',', '.', ';', ':', '!', '?', '--', '(', ')', '"', '»', '«']):
+def clean_sentence(sentence: str, collapseSpaces: bool = True, stripDashes: bool = True, dropHeaders: bool = True, dropLetterless: bool = True) -> Optional[str]:
+   '''
+   Normalise a sentence extracted from a corpus file, or reject it if it cannot be used in the game.
+
+   :param str sentence: sentence to clean
+
+   :param bool collapseSpaces: (**Optional**) whether to replace runs of whitespace by a single space and remove leading and trailing whitespace
+   :param bool dropHeaders: (**Optional**) whether to remove leading parts written in capital letters and separated from the rest by several spaces (titles, dedications, etc.), and to reject sentences entirely written in capital letters
+   :param bool dropLetterless: (**Optional**) whether to reject sentences without any letter
+   :param bool stripDashes: (**Optional**) whether to remove dialogue dashes at the start of the sentence
+
+   :returns: cleaned sentence or None if it is rejected
+   :rtype: str or None
+   '''
+
+   if dropHeaders:
+      parts        = re.split(r'\s{2,}', sentence.strip())
+
+      # Headers are only recognised in parts with at least two letters so that single capital letters are kept
+      while parts and is_header(parts[0]):
+         parts.pop(0)
+
+      sentence     = '  '.join(parts)
+
+   if stripDashes:
+      sentence     = re.sub(r'^\s*(?:-+|—|–)\s*', '', sentence)
+
+   if collapseSpaces:
+      sentence     = ' '.join(sentence.split())
+
+   if sentence.strip() == '' or (dropLetterless and not any(char.isalpha() for char in sentence)):
+      return None
+
+   return sentence
+
+def is_header(text: str) -> bool:
+   '''
+   Check whether a piece of text is entirely written in capital letters.
+
+   :param str text: text to check
+
+   :returns: True if it has at least two letters and all of them are capital letters, False otherwise
+   :rtype: bool
+   '''
+
+   letters         = [char for char in text if char.isalpha()]
+   return len(letters) > 1 and all(char.isupper() for char in letters)
+
+#: Tokens which are not considered as words. Double quotes are also listed as converted by the word tokenizers (see tokenizer.span_tokenize).
+EXCLUDED_WORDS = [',', '.', ';', ':', '!', '?', '--', '(', ')', '"', '``', "''", '»', '«']
+
+def make_words(sentence, exclude=EXCLUDED_WORDS):
    '''
    Extract words from sentences, removing some characters.
 
@@ -57,7 +339,7 @@ def make_words(sentence, exclude=[',', '.', ';', ':', '!', '?', '--', '(', ')',
    :rtype: list[str]
    '''
 
-   words = nltk.word_tokenize(sentence)
+   words = WORD_TOKENIZERS[word_tokenizer](sentence)
 
    if exclude is not None:
       words = [i for i in words if i not in exclude]
@@ -69,75 +351,376 @@ def make_vowels_consonants(sentence, language):
    Extract all the vowels and consonants in a given sentence.
 
    :param str sentence: sentence to extract vowels and consonants from
-   :param dict language: dictionary defining the alphabet of the language used to extract vowels and consonants from the sentence
+   :param Language language: alphabet of the language used to extract vowels and consonants from the sentence. A dictionary is compiled into a Language first.
 
-   :returns: list of vowels, list of consonants
+   :returns: list of vowels, list of consonants, in order of appearance
    :rtype: list[str], list[str]
    '''
 
-   # If alternations are considered, then they are similar to the characters they map to, in which case they do not appear in the vowel or consonant lists but must be mapped
-   # If alternations are not considered, alteradted characters are different and therefore do appear in the vowel and consonant lists
-   alternations = language['map_alternate']
+   # If alternations are considered, alternated characters are mapped in the table to the characters they map to, otherwise they are letters of their own
+   table        = as_language(language).table
+
+   consonants   = {}
+   vowels       = {}
+
+   # Each different character is looked up once, dictionaries keep the order of the first appearance of each letter
+   for char in dict.fromkeys(sentence):
+      entry     = table.get(char)
+
+      if entry is not None:
+         if entry[0] == VOWEL:
+            vowels[entry[1]]     = None
+         else:
+            consonants[entry[1]] = None
+
+   return list(vowels), list(consonants)
+
+def make_letter_masks(blob, offsets, language, chunkSize=16777216):
+   '''
+   Find the letters appearing in many sentences at once. Characters are classified through the lookup table of the language with numpy, so that the cost per character does not involve Python code.
+
+   :param bytes blob: sentences encoded in UTF-8 one after the other, e.g. the blob of a SentenceStore
+   :param offsets: position in bytes of the start of each sentence in the blob, followed by the position of the end of the last sentence
+   :type offsets: ndarray[int] or list[int]
+   :param Language language: alphabet of the language
+
+   :param int chunkSize: (**Optional**) approximate number of bytes classified at once, used to bound memory usage
+
+   :returns: letter mask of each sentence (see Language.mask)
+   :rtype: ndarray[uint64] of shape (number of sentences, language.words)
+   '''
+
+   language        = as_language(language)
+   offsets         = np.asarray(offsets, dtype=np.int64)
+   masks           = np.zeros((len(offsets) - 1, language.words), dtype=np.uint64)
+   lookup          = language.lookup
 
-   consonants   = []
-   vowels       = []
+   first           = 0
+   while first < len(masks):
 
-   for char in sentence:
+      # Sentences are classified by groups of about chunkSize bytes
+      last         = max(int(np.searchsorted(offsets, offsets[first] + chunkSize, side='right')) - 1, first + 1)
+      last         = min(last, len(masks))
+      data         = bytes(blob[offsets[first]:offsets[last]])
 
-      if char in language['consonants'] and char not in consonants:
-         consonants.append(char)
-      elif char in language['vowels'] and char not in vowels:
-         vowels.append(char)
-      else:
-         # If character is neither a vowel or a consonant, it can be an alternated character
-         if char in alternations.keys():
-            if alternations[char] in language['vowels'] and alternations[char] not in vowels:
-               vowels.append(alternations[char])
-            elif alternations[char] in language['consonants'] and alternations[char] not in consonants:
-               consonants.append(alternations[char])
+      # Number of characters before each sentence, given by the bytes which do not continue a multibyte character
+      starts       = (np.frombuffer(data, dtype=np.uint8) & 0xC0) != 0x80
+      chars        = np.concatenate(([0], np.cumsum(starts)))[offsets[first:last+1] - offsets[first]]
 
-   return vowels, consonants
+      codes        = np.frombuffer(data.decode('utf-8').encode('utf-32-le'), dtype='<u4')
+      positions    = np.full(len(codes) + 1, -1, dtype=np.int16)
+      known        = codes < len(lookup)
+      positions[:-1][known] = lookup[codes[known]]
 
-def pick_sentence(sentences, minWords=1, maxWords=14, maxPass=100):
+      # Letter bits of each character, OR-ed over each sentence. The extra character ends empty sentences at the end of the chunk.
+      empty        = chars[:-1] == chars[1:]
+      for word in range(language.words):
+         inWord    = (positions >= 64*word) & (positions < 64*(word+1))
+         bits      = np.zeros(len(positions), dtype=np.uint64)
+         bits[inWord] = np.uint64(1) << (positions[inWord] - 64*word).astype(np.uint64)
+
+         reduced   = np.bitwise_or.reduceat(bits, chars[:-1])
+         reduced[empty] = 0
+         masks[first:last, word] = reduced
+
+      first        = last
+
+   return masks
+
+def make_word_counts(sentences):
+   '''
+   Count the number of words in each sentence.
+
+   :param list[str] sentences: list of sentences
+
+   :returns: number of words of each sentence
+   :rtype: list[int]
+   '''
+
+   return [len(make_words(sentence)) for sentence in sentences]
+
+def count_swaps(sentence):
+   '''
+   Count the positions where two consecutive words can be swapped by the Swap rule, i.e. words only separated by spaces.
+
+   :param str sentence: sentence
+
+   :returns: number of positions
+   :rtype: int
+   '''
+
+   tokens = tokenizer.span_tokenize(sentence)
+
+   return sum(1 for (token1, start1, end1), (token2, start2, end2) in zip(tokens, tokens[1:])
+              if token1 not in EXCLUDED_WORDS and token2 not in EXCLUDED_WORDS and sentence[end1:start2].isspace())
+
+#: Index of the number of words of each list of sentences given to pick_sentence and pick_sentences without an index, with the list itself so that its identifier is not reused
+_INDEXES = {}
+
+def word_count_index(sentences):
+   '''
+   Index of the number of words of a list of sentences. It is built the first time the list is used, which requires to tokenize all the sentences, and is then reused as long as the list keeps the same length. Only the indexes of the last few lists are kept.
+
+   :param list[str] sentences: list of sentences
+
+   :returns: index
+   :rtype: WordCountIndex
+   '''
+
+   entry                    = _INDEXES.get(id(sentences))
+
+   if entry is None or entry[0] is not sentences or len(entry[1]) != len(sentences):
+      if len(_INDEXES) >= 8:
+         del _INDEXES[next(iter(_INDEXES))]
+
+      entry                 = (sentences, WordCountIndex(make_word_counts(sentences)))
+      _INDEXES[id(sentences)] = entry
+
+   return entry[1]
+
+def pick_sentence(sentences, minWords=1, maxWords=14, index=None, rng=random):
    '''
    Pick a sentence in a list of sentences with correct properties.
 
    :param list[str] sentences: list of sentences to pick a sentence from
 
-   :param int maxPass: (**Optional**) maximum number of passes allowed when picking up a sentence
+   :param WordCountIndex index: (**Optional**) index of the number of words of the sentences. If None, the index of the list is used, see word_count_index.
    :param int maxWords: (**Optional**) maximum number of words allowed in the sentence
    :param int minWords: (**Optional**) minimum number of words allowed in the sentence
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
 
    :returns:
 
-      * if **npass** < **maxPass** : picked sentence, list of words and number of words
+      * if a sentence has a number of words in the range : picked sentence, list of words and number of words
       * else : None, [], 0
 
    :rtype:
 
-      * **npass** < **maxPass** : str, list[str], int
+      * if a sentence has a number of words in the range : str, list[str], int
       * else : None, list, int
    '''
 
-   lwords      = maxWords+1 # Number of words in the picked sentence
-   npass       = 0          # Number of passes when picking up a sentence
+   if index is None:
+      index    = word_count_index(sentences)
 
-   # Loop until we find a sentence which matches user preferences
-   sentence    = None
-   while (lwords < minWords or lwords > maxWords) and npass < maxPass:
+   # Draw directly among the sentences which match user preferences
+   pos         = index.draw(minWords, maxWords, rng=rng)
 
-      # Pick just one
-      sentence = random.choice(sentences)
+   if pos is None:
+      return None, [], 0
 
-      # Count number of words
-      words    = make_words(sentence)
-      lwords   = len(words)
-      npass   += 1
+   sentence    = sentences[pos]
+   return sentence, make_words(sentence), int(index.counts[pos])
 
-   if npass < maxPass:
-      return sentence, words, lwords
-   else:
-      return None
+def pick_sentences(sentences, n, minWords=1, maxWords=14, replace=True, index=None, rng=None):
+   '''
+   Pick several sentences at once in a list of sentences with correct properties.
+
+   :param list[str] sentences: list of sentences to pick the sentences from
+   :param int n: number of sentences to pick
+
+   :param WordCountIndex index: (**Optional**) index of the number of words of the sentences. If None, the index of the list is used, see word_count_index.
+   :param int maxWords: (**Optional**) maximum number of words allowed in the sentences
+   :param int minWords: (**Optional**) minimum number of words allowed in the sentences
+   :param bool replace: (**Optional**) whether the same sentence can be picked several times or not
+   :param rng: (**Optional**) random number generator or seed. See index.numpyGenerator.
+
+   :returns: picked sentences and their number of words
+   :rtype: list[str], ndarray[int]
+
+   :raises ValueError: if not enough sentences have a number of words in the range
+   '''
+
+   if index is None:
+      index    = word_count_index(sentences)
+
+   positions   = index.sample(n, minWords, maxWords, replace=replace, rng=rng)
+
+   return [sentences[pos] for pos in positions], index.counts[positions]
+
+
+#################################
+#      Tokenized sentences      #
+#################################
+
+class Sentence:
+    r'''
+    A sentence split into tokens, with the letters found in each token. The text of the sentence is the concatenation of gaps and tokens:
+
+        gaps[0] + tokens[0] + gaps[1] + ... + tokens[-1] + gaps[-1]
+
+    Rules modify tokens in place with setToken and swap, so that only the modified tokens are analysed again.
+    '''
+
+    def __init__(self, text: str, language: dict, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param str text: text of the sentence
+        :param Language language: alphabet of the language used. A dictionary is compiled into a Language first.
+        '''
+
+        #: Alphabet of the language used
+        self.language        = as_language(language)
+
+        #: Text of each token, as it appears in the sentence
+        self.tokens          = []
+
+        #: Text between tokens. There is one more gap than tokens.
+        self.gaps            = []
+
+        #: Whether each token is a word, i.e. not a punctuation mark (see make_words)
+        self.isWord          = []
+
+        end                  = 0
+        for token, start, stop in tokenizer.span_tokenize(text):
+            self.gaps.append(text[end:start])
+            self.tokens.append(text[start:stop])
+            self.isWord.append(token not in EXCLUDED_WORDS)
+            end              = stop
+
+        self.gaps.append(text[end:])
+
+        #: Vowels and consonants of each token
+        self.tokenVowels     = []
+        self.tokenConsonants = []
+
+        for token in self.tokens:
+            vowels, consonants = make_vowels_consonants(token, self.language)
+            self.tokenVowels.append(vowels)
+            self.tokenConsonants.append(consonants)
+
+        #: Number of occurrences of each vowel and consonant in the sentence, alternate forms being counted with their letter. Letters which do not appear are not keys.
+        self.vowelCounts     = {}
+        self.consonantCounts = {}
+
+        for token in self.tokens:
+            self._count(token, 1)
+
+        self._text           = text
+
+    def __len__(self) -> int:
+        r'''Number of tokens.'''
+
+        return len(self.tokens)
+
+    def __str__(self) -> str:
+
+        return self.text
+
+    def copy(self):
+        r'''
+        Copy of the sentence which can be modified independently. Letter inventories of the tokens are shared since they are replaced, never modified, by setToken.
+
+        :returns: copy of the sentence
+        :rtype: Sentence
+        '''
+
+        new                 = Sentence.__new__(Sentence)
+        new.__dict__        = {key: (value.copy() if isinstance(value, list) else value) for key, value in self.__dict__.items()}
+        new.vowelCounts     = dict(self.vowelCounts)
+        new.consonantCounts = dict(self.consonantCounts)
+
+        return new
+
+    def _count(self, token: str, sign: int) -> None:
+        r'''
+        Add the letters of a token to the occurrence counts of the sentence, or remove them.
+
+        :param str token: token
+        :param int sign: 1 to add the letters, -1 to remove them
+        '''
+
+        table                = self.language.table
+        for char in token:
+            entry            = table.get(char)
+
+            if entry is not None:
+                counts       = self.vowelCounts if entry[0] == VOWEL else self.consonantCounts
+                count        = counts.get(entry[1], 0) + sign
+
+                if count == 0:
+                    del counts[entry[1]]
+                else:
+                    counts[entry[1]] = count
+
+        return
+
+    @property
+    def text(self) -> str:
+        r'''Text of the sentence. It is only rebuilt after tokens were modified.'''
+
+        if self._text is None:
+            parts          = [self.gaps[0]]
+            for token, gap in zip(self.tokens, self.gaps[1:]):
+                parts     += [token, gap]
+
+            self._text     = ''.join(parts)
+
+        return self._text
+
+    @property
+    def spans(self) -> list[tuple[int, int]]:
+        r'''Start and end positions of each token in the text of the sentence.'''
+
+        spans              = []
+        end                = 0
+        for token, gap in zip(self.tokens, self.gaps):
+            start          = end + len(gap)
+            end            = start + len(token)
+            spans.append((start, end))
+
+        return spans
+
+    @property
+    def words(self) -> list[str]:
+        r'''Tokens which are words.'''
+
+        return [token for token, isWord in zip(self.tokens, self.isWord) if isWord]
+
+    @property
+    def vowels(self) -> list[str]:
+        r'''Vowels appearing in the sentence. Letters come in order of appearance in the original sentence, followed by the letters added by the rules.'''
+
+        return list(self.vowelCounts)
+
+    @property
+    def consonants(self) -> list[str]:
+        r'''Consonants appearing in the sentence. Letters come in order of appearance in the original sentence, followed by the letters added by the rules.'''
+
+        return list(self.consonantCounts)
+
+    def setToken(self, pos: int, token: str) -> None:
+        r'''
+        Replace the text of a token and update its letters.
+
+        :param int pos: position of the token
+        :param str token: new text of the token
+        '''
+
+        if token != self.tokens[pos]:
+            self._count(self.tokens[pos], -1)
+            self._count(token, 1)
+
+            self.tokens[pos]                                     = token
+            self.tokenVowels[pos], self.tokenConsonants[pos]     = make_vowels_consonants(token, self.language)
+            self._text                                           = None
+
+        return
+
+    def swap(self, pos1: int, pos2: int) -> None:
+        r'''
+        Swap two tokens. Gaps stay in place.
+
+        :param int pos1: position of the first token
+        :param int pos2: position of the second token
+        '''
+
+        for values in (self.tokens, self.isWord, self.tokenVowels, self.tokenConsonants):
+            values[pos1], values[pos2] = values[pos2], values[pos1]
+
+        self._text                     = None
+        return
 
 
 #################################
@@ -146,344 +729,316 @@ def pick_sentence(sentences, minWords=1, maxWords=14, maxPass=100):
 
 # nltk.tokenize.legality_principle module to split into syllables
 
-def VowtoVow_All(sentence, language, vowels=None):
+def translation_table(language, letter_out, letter_in):
+   '''
+   Translation table replacing a letter, and its alternated forms if alternations are considered, by another one. Tables precomputed in a language pack are used when available (see Language.compileTranslations), other ones are cached for each language, so that they are only built the first time a pair of letters is used.
+
+   :param Language language: alphabet of the language used
+   :param str letter_out: letter to replace
+   :param str letter_in: letter put instead
+
+   :returns: translation table to use with str.translate
+   :rtype: dict
+   '''
+
+   table = language.translations.get((letter_out, letter_in))
+   if table is None:
+      table = _translation_table(language, letter_out, letter_in)
+
+   return table
+
+@lru_cache(maxsize=4096)
+def _translation_table(language, letter_out, letter_in):
+   '''Build a translation table. See translation_table.'''
+
+   return language.translationTable(letter_out, letter_in)
+
+def change_letter(sentence, language, letter_out, letter_in, positions):
+   '''
+   Replace a letter, and its alternated forms if alternations are considered, by another one in some tokens of a sentence. Each token is modified in a single pass.
+
+   :param Sentence sentence: sentence to modify in place
+   :param dict language: dictionary describing the language used
+   :param str letter_out: letter to replace
+   :param str letter_in: letter put instead
+   :param list[int] positions: positions of the tokens to modify
+   '''
+
+   table              = translation_table(as_language(language), letter_out, letter_in)
+
+   for pos in positions:
+      sentence.setToken(pos, sentence.tokens[pos].translate(table))
+
+   return
+
+def VowtoVow_All(sentence, language, rng=random):
    '''
    Randomly modify a vowel into another one in all the occurences in the sentence.
 
-   :param str sentence: sentence to modify the vowel from
+   :param Sentence sentence: sentence to modify in place
    :param dict language: dictionary describing the language used
 
-   :param list vowels: list of vowels appearing in the sentence
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
 
-   :returns: modified sentence, new vowels list, vowel removed, vowel added
-   :rtype: str, list[str], str, str
+   :returns: vowel removed, vowel added, or None, None if the sentence has no vowel
+   :rtype: str, str
    '''
-   
-   #print(vowels, sentence)
 
-   if vowels is None:
-      raise ValueError('A vowels list must be given.')
-      
+   vowels            = sentence.vowels
+
    # If no vowel found, do not go further
    if len(vowels) == 0:
-       return None, None, None, None
-       
+       return None, None
+
    # Pick a vowel in the sentence
-   vowel_out         = random.choice(vowels)
+   vowel_out         = rng.choice(vowels)
 
    # Pick a vowel to put in the sentence
-   vowel_in          = random.choice(language['vowels'])
-
-   # Replace the vowel
-   sentence          = sentence.replace(vowel_out, vowel_in)
-
-   vowels.remove(vowel_out)
-   if vowel_in not in vowels:
-      vowels.append(vowel_in)
-
-   # Take care of alternations
-   if vowel_out in language['map_alternate_inv']:
-      for alternation in language['map_alternate_inv'][vowel_out]:
+   vowel_in          = rng.choice(language['vowels'])
 
-         if alternation in sentence:
-            sentence = sentence.replace(alternation, vowel_in)
+   # Replace the vowel in the tokens where it appears
+   change_letter(sentence, language, vowel_out, vowel_in, [pos for pos, vow in enumerate(sentence.tokenVowels) if vowel_out in vow])
 
-   return sentence, vowels, vowel_out, vowel_in
+   return vowel_out, vowel_in
 
-def VowtoVow_Single(sentence, language, vowels_sen=None):
+def VowtoVow_Single(sentence, language, rng=random):
    '''
    Randomly modify a vowel into another one in a randomly chosen word.
 
-   :param str sentence: sentence to modify the vowel from
+   :param Sentence sentence: sentence to modify in place
    :param dict language: dictionary describing the language used
-   
-   :param list vowels_sen: list of vowels appearing in the sentence
 
-   :returns: modified sentence, picked word, new vowels list, vowel removed, vowel added
-   :rtype: str, str, list[str], str, str
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+
+   :returns: picked word, vowel removed, vowel added, or None, None, None if the sentence has no word with a vowel
+   :rtype: str, str, str
    '''
-   
-   # For debug purposes
-   tmp_sen = sentence
-   
-   #print(vowels_sen, sentence)
-   
-   if vowels_sen is None:
-      raise ValueError('A vowels list must be given.')
-      
-   # If no vowel found, do not go further
-   if len(vowels_sen) == 0:
-       return None, None, None, None, None
-   
-   # Split words from sentence
-   words_all          = make_words(sentence)
-   
+
+   if len(sentence.vowelCounts) == 0:
+       return None, None, None
+
    # Only keep words which have vowels
-   words              = []
-   vowels_list        = []
-   for w in words_all:
-       
-       vow, con       = make_vowels_consonants(w, language)
-       if len(vow) != 0:
-           words.append(w)
-           vowels_list.append(vow)
-        
+   words              = [pos for pos, vow in enumerate(sentence.tokenVowels) if sentence.isWord[pos] and len(vow) != 0]
+
+   # If no vowel found, do not go further
+   if len(words) == 0:
+       return None, None, None
 
    ##################################
    #         Random choices         #
    ##################################
 
    # Pick a random word
-   pos                = random.choice(range(len(words)))
-   word               = words[pos]
-   vowels             = vowels_list[pos]
+   pos                = rng.choice(words)
+   word               = sentence.tokens[pos]
+   vowels             = sentence.tokenVowels[pos]
 
    # Pick a vowel in the selected word
-   vowel_out          = random.choice(vowels)
+   vowel_out          = rng.choice(vowels)
 
    # Pick a vowel to put in the sentence
-   vowel_in           = random.choice(language['vowels'])
-
-
-   ############################
-   #      Split sentence      #
-   ############################
-
-   # Split the sentence excluding some characters
-   sentence_split     = make_words(sentence)
-
-   # Split the sentence keeping characters such as , in words
-   sentence_rec       = sentence.split(' ')
-
+   vowel_in           = rng.choice(language['vowels'])
 
    ###########################################
    #            Replace the vowel            #
    ###########################################
 
-   for pos in range(len(sentence_split)):
-      if sentence_split[pos].lower() == word.lower():
-         sentence_rec[pos]          = sentence_rec[pos].replace(vowel_out, vowel_in)
-
-         # Take care of alternations
-         if vowel_out in language['map_alternate_inv']:
-            for alternation in language['map_alternate_inv'][vowel_out]:
-               if alternation in word:
-                  sentence_rec[pos] = sentence_rec[pos].replace(alternation, vowel_in)
-
-   # Reconstruct the sentence
-   sentence = ' '.join(sentence_rec)
+   # Every occurence of the word is modified
+   change_letter(sentence, language, vowel_out, vowel_in, [pos for pos in words if sentence.tokens[pos].lower() == word.lower()])
 
-   # Remove the previous vowel from the vowel list if it disappeared from the sentence
-   if vowel_out not in sentence:
-       vowels_sen.remove(vowel_out)
-       
-   # Add the new vowel into the vowel list if it was not already present
-   if vowel_in not in vowels_sen:
-      vowels_sen.append(vowel_in)
+   return word, vowel_out, vowel_in
 
-   return sentence, word, vowels_sen, vowel_out, vowel_in
-
-def ContoCon_All(sentence, language, consonants=None):
+def ContoCon_All(sentence, language, rng=random):
    '''
    Randomly modify a consonant into another one in all the occurences in the sentence.
 
-   :param str sentence: sentence to modify the consonant from
+   :param Sentence sentence: sentence to modify in place
    :param dict language: dictionary describing the language used
 
-   :param list consonants: list of consonants appearing in the sentence
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
 
-   :returns: modified sentence, new consonants list, consonant removed, consonant added
-   :rtype: str, list[str], str, str
+   :returns: consonant removed, consonant added, or None, None if the sentence has no consonant
+   :rtype: str, str
    '''
 
-   if consonants is None:
-      raise ValueError('A consonants list must be given.')
-      
-   # If no vowel found, do not go further
+   consonants        = sentence.consonants
+
+   # If no consonant found, do not go further
    if len(consonants) == 0:
-       return None, None, None, None
-       
-   # Pick a vowel in the sentence
-   consonant_out     = random.choice(consonants)
+       return None, None
 
-   # Pick a vowel to put in the sentence
-   consonant_in      = random.choice(language['consonants'])
+   # Pick a consonant in the sentence
+   consonant_out     = rng.choice(consonants)
+
+   # Pick a consonant to put in the sentence
+   consonant_in      = rng.choice(language['consonants'])
 
-   # Replace the vowel
-   sentence          = sentence.replace(consonant_out, consonant_in)
+   # Replace the consonant in the tokens where it appears
+   change_letter(sentence, language, consonant_out, consonant_in, [pos for pos, con in enumerate(sentence.tokenConsonants) if consonant_out in con])
 
-   consonants.remove(consonant_out)
-   if consonant_in not in consonants:
-      consonants.append(consonant_in)
+   return consonant_out, consonant_in
 
-   # Take care of alternations
-   if consonant_out in language['map_alternate_inv']:
-      for alternation in language['map_alternate_inv'][consonant_out]:
+def ContoCon_Single(sentence, language, rng=random):
+   '''
+   Randomly modify a consonant into another one in a randomly chosen word.
 
-         if alternation in sentence:
-            sentence = sentence.replace(alternation, consonant_in)
+   :param Sentence sentence: sentence to modify in place
+   :param dict language: dictionary describing the language used
 
-   return sentence, consonants, consonant_out, consonant_in
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
 
-def ContoCon_Single(sentence, language, consonants_sen=None):
+   :returns: picked word, consonant removed, consonant added, or None, None, None if the sentence has no word with a consonant
+   :rtype: str, str, str
    '''
-   Randomly modify a vowel into another one in a randomly chosen word.
 
-   :param str sentence: sentence to modify the vowel from
-   :param dict language: dictionary describing the lnaguage used
-   
-   :param list consonants_sen: list of consonants appearing in the sentence
+   if len(sentence.consonantCounts) == 0:
+       return None, None, None
 
-   :returns: modified sentence, picked word, new consonants list, consonant removed, consonant added
-   :rtype: str, str, list[str], str, str
-   '''
-   
-   if consonants_sen is None:  
-      raise ValueError('A consonants list must be given.')
-      
-   # If no consonant found, do not go further
-   if len(consonants_sen) == 0:
-       return None, None, None, None, None
-   
-   # Split words from sentence
-   words_all          = make_words(sentence)
-   
    # Only keep words which have consonants
-   words              = []
-   consonants_list    = []
-   for w in words_all:
-       
-       vow, con       = make_vowels_consonants(w, language)
-       if len(con) != 0:
-           words.append(w)
-           consonants_list.append(con)
-           
+   words              = [pos for pos, con in enumerate(sentence.tokenConsonants) if sentence.isWord[pos] and len(con) != 0]
+
+   # If no consonant found, do not go further
+   if len(words) == 0:
+       return None, None, None
 
    ##################################
    #         Random choices         #
    ##################################
 
    # Pick a random word
-   pos                = random.choice(range(len(words)))
-   word               = words[pos]
-   consonants         = consonants_list[pos]
+   pos                = rng.choice(words)
+   word               = sentence.tokens[pos]
+   consonants         = sentence.tokenConsonants[pos]
 
    # Pick a consonant in the selected word
-   consonant_out      = random.choice(consonants)
+   consonant_out      = rng.choice(consonants)
 
    # Pick a consonant to put in the sentence
-   consonant_in       = random.choice(language['consonants'])
+   consonant_in       = rng.choice(language['consonants'])
 
+   ###############################################
+   #            Replace the consonant            #
+   ###############################################
 
-   ############################
-   #      Split sentence      #
-   ############################
+   # Every occurence of the word is modified
+   change_letter(sentence, language, consonant_out, consonant_in, [pos for pos in words if sentence.tokens[pos].lower() == word.lower()])
 
-   # Split the sentence excluding some characters
-   sentence_split     = make_words(sentence)
+   return word, consonant_out, consonant_in
 
-   # Split the sentence keeping characters such as , in words
-   sentence_rec       = sentence.split(' ')
+def LettoLet_Single(sentence, language, rng=random):
+   '''
+   Randomly modify a letter, vowel or consonant, into another one in a randomly chosen word.
 
+   :param Sentence sentence: sentence to modify in place
+   :param dict language: dictionary describing the language used
 
-   ###########################################
-   #            Replace the vowel            #
-   ###########################################
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
 
-   for pos in range(len(sentence_split)):
-      if sentence_split[pos].lower() == word.lower():
-         sentence_rec[pos]          = sentence_rec[pos].replace(consonant_out, consonant_in)
+   :returns: picked word, letter removed, letter added, or None, None, None if the sentence has no word with a letter
+   :rtype: str, str, str
+   '''
 
-         # Take care of alternations
-         if consonant_out in language['map_alternate_inv']:
-            for alternation in language['map_alternate_inv'][consonant_out]:
-               if alternation in word:
-                  sentence_rec[pos] = sentence_rec[pos].replace(alternation, consonant_in)
+   if len(sentence.vowelCounts) + len(sentence.consonantCounts) == 0:
+       return None, None, None
 
-   # Reconstruct the sentence
-   sentence = ' '.join(sentence_rec)
+   # Only keep words which have letters
+   words              = [pos for pos in range(len(sentence)) if sentence.isWord[pos] and len(sentence.tokenVowels[pos]) + len(sentence.tokenConsonants[pos]) != 0]
 
-   # Remove the previous consonant from the consonant list if it disappeared from the sentence
-   if consonant_out not in sentence:
-       consonants_sen.remove(consonant_out)
-       
-   # Add the new consonant into the consonant list if it was not already present
-   if consonant_in not in consonants_sen:
-      consonants_sen.append(consonant_in)
+   if len(words) == 0:
+       return None, None, None
 
-   return sentence, word, consonants_sen, consonant_out, consonant_in
+   # Pick a random word, a letter in this word and a letter to put instead
+   pos                = rng.choice(words)
+   word               = sentence.tokens[pos]
+   letter_out         = rng.choice(sentence.tokenVowels[pos] + sentence.tokenConsonants[pos])
+   letter_in          = rng.choice(language['vowels'] + language['consonants'])
 
-def LettoLet_Single():
-   return
+   # Every occurence of the word is modified
+   change_letter(sentence, language, letter_out, letter_in, [pos for pos in words if sentence.tokens[pos].lower() == word.lower()])
 
-def LettoLet_All():
-   return
+   return word, letter_out, letter_in
 
-def Swap(sentence):
+def LettoLet_All(sentence, language, rng=random):
    '''
-   Swap two consecutive words in the sentence and return the new sentence.
-   
-   :param str sentence: sentence from which two words will be swapped.
-   
-   :returns: new sentence or None, None, None if no words could be swapped
+   Randomly modify a letter, vowel or consonant, into another one in all the occurences in the sentence.
+
+   :param Sentence sentence: sentence to modify in place
+   :param dict language: dictionary describing the language used
+
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+
+   :returns: letter removed, letter added, or None, None if the sentence has no letter
+   :rtype: str, str
    '''
-   
-   # Split the sentence excluding some characters
-   sentence_split     = make_words(sentence)
-   ll                 = len(sentence_split)
-   ll1                = ll-1
-   
-   # If only a single word, we cannot swap
-   if ll < 2:
-      return None, None, None
-   
-   # Split the sentence keeping characters such as , in words
-   sentence_rec       = sentence.split(' ')
-   
-   # Only find words ok to be swapped (no special characters)
-   okPos              = []
-   for pos in range(ll):
-       
-      # Current word to check
-      split           = sentence_split[pos]
-      rec             = sentence_rec[pos]
-      
-      # Next or previous word to check
-      if pos == ll1:
-         osplit       = sentence_split[pos-1]
-         orec         = sentence_rec[pos-1]
-      else:
-         osplit       = sentence_split[pos+1]
-         orec         = sentence_rec[pos+1]
-         
-      # We save the word only if both are ok to be swapped
-      if split == rec and osplit == orec:
-         okPos.append(pos)
-   
-   # If no words meet the criteria, no swap
-   if len(okPos) == 0:
-      return None, None, None
-   
-   # Pick a position in the sentence
-   pos1               = random.choice(okPos)
-   word1              = sentence_rec[pos1]
-   
-   if pos1 == ll1:
-      pos2            = pos1-1
-   else:
-      pos2            = pos1+1
-   
-   # Replace words in sentence list
-   word2              = sentence_rec[pos2]
-   sentence_rec[pos2] = word1
-   sentence_rec[pos1] = word2
-   
-   # Reconstruct the sentence
-   sentence           = ' '.join(sentence_rec)
-   
-   return sentence, word1, word2
 
+   letters            = sentence.vowels + sentence.consonants
+
+   # If no letter found, do not go further
+   if len(letters) == 0:
+       return None, None
+
+   # Pick a letter in the sentence and a letter to put instead
+   letter_out         = rng.choice(letters)
+   letter_in          = rng.choice(language['vowels'] + language['consonants'])
+
+   # Replace the letter in the tokens where it appears
+   change_letter(sentence, language, letter_out, letter_in, [pos for pos in range(len(sentence)) if letter_out in sentence.tokenVowels[pos] or letter_out in sentence.tokenConsonants[pos]])
+
+   return letter_out, letter_in
+
+def Delete(sentence, language, rng=random):
+   '''
+   Randomly remove a letter, and its alternated forms if alternations are considered, from a randomly chosen word. Only words with at least two different letters are picked, so that no word disappears.
+
+   :param Sentence sentence: sentence to modify in place
+   :param dict language: dictionary describing the language used
+
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+
+   :returns: picked word, letter removed, or None, None if no word has two different letters
+   :rtype: str, str
+   '''
+
+   # Only keep words which keep a letter once one is removed
+   words              = [pos for pos in range(len(sentence)) if sentence.isWord[pos] and len(sentence.tokenVowels[pos]) + len(sentence.tokenConsonants[pos]) > 1]
+
+   if len(words) == 0:
+       return None, None
+
+   # Pick a random word and a letter in this word
+   pos                = rng.choice(words)
+   word               = sentence.tokens[pos]
+   letter             = rng.choice(sentence.tokenVowels[pos] + sentence.tokenConsonants[pos])
+
+   # Every occurence of the word is modified, the letter being replaced by nothing
+   change_letter(sentence, language, letter, '', [pos for pos in words if sentence.tokens[pos].lower() == word.lower()])
+
+   return word, letter
 
+def Swap(sentence, rng=random):
+   '''
+   Swap two consecutive words in the sentence.
+
+   :param Sentence sentence: sentence to modify in place
+
+   :param rng: (**Optional**) random number generator. It can be a random.Random instance or the random module.
+
+   :returns: swapped words, or None, None if no words could be swapped
+   :rtype: str, str
+   '''
 
+   # Only words separated by spaces are swapped, so that punctuation stays in place
+   okPos              = [pos for pos in range(len(sentence)-1) if sentence.isWord[pos] and sentence.isWord[pos+1] and sentence.gaps[pos+1].isspace()]
+
+   # If no words meet the criteria, no swap
+   if len(okPos) == 0:
+      return None, None
+
+   # Pick a position in the sentence
+   pos                = rng.choice(okPos)
+   word1              = sentence.tokens[pos]
+   word2              = sentence.tokens[pos+1]
 
+   sentence.swap(pos, pos+1)
 
+   return word1, word2
@@ -0,0 +1,266 @@
+# Compact on-disk storage of the sentences of a corpus
+# Mercier Wilfried - IRAP
+
+import os
+import mmap
+import tempfile
+import numpy           as np
+import os.path         as opath
+from   array           import array
+from   collections.abc import Sequence
+from   contextlib      import contextmanager
+from   typing          import Optional
+
+@contextmanager
+def replacing(file: str):
+   r'''
+   Write a file under a unique temporary name in the same directory, and replace the file with it once it is written without error. Several writers of the same file, e.g. a cancelled loader and a new one, therefore never write into the same temporary file, and an interrupted write never leaves a corrupted file behind.
+
+   >>> with replacing(file) as f:
+   >>>     f.write(data)
+
+   :param str file: file to write
+
+   :returns: context manager giving the temporary file, opened in binary mode
+   '''
+
+   fd, name = tempfile.mkstemp(dir=opath.dirname(opath.abspath(file)), prefix=f'{opath.basename(file)}.', suffix='.tmp')
+
+   try:
+      with os.fdopen(fd, 'wb') as f:
+         yield f
+   except BaseException:
+      os.remove(name)
+      raise
+
+   os.replace(name, file)
+   return
+
+def write_rows(file: str, rows: np.ndarray, start: Optional[int] = None, offset: int = 0) -> None:
+   r'''
+   Write the rows of an array into a raw file.
+
+   :param str file: file to write
+   :param ndarray rows: rows to write
+
+   :param int offset: (**Optional**) position in bytes of the first row in the file when rows are written in place
+   :param int start: (**Optional**) row from which the rows are written in place. Rows before it are left unchanged and the file is never truncated, so that arrays mapping it stay valid, but rows after the last one written may remain. If None, the file is replaced by the rows (see replacing).
+   '''
+
+   rows     = np.ascontiguousarray(rows)
+
+   if start is None:
+      with replacing(file) as f:
+         f.write(rows.tobytes())
+   else:
+      with open(file, 'r+b') as f:
+         f.seek(offset + start * rows.itemsize * int(np.prod(rows.shape[1:])))
+         f.write(rows.tobytes())
+
+   return
+
+def map_rows(file: str, dtype, shape: tuple, offset: int = 0) -> np.ndarray:
+   r'''
+   Map read-only the first rows of a raw file, e.g. written by write_rows.
+
+   :param str file: file to map
+   :param dtype: type of the values
+   :param tuple shape: shape of the array, the first dimension being the number of rows
+
+   :param int offset: (**Optional**) position in bytes of the first row in the file
+
+   :returns: array mapping the file
+   :rtype: ndarray
+   '''
+
+   # mmap cannot map empty arrays
+   if int(np.prod(shape)) == 0:
+      return np.zeros(shape, dtype=dtype)
+
+   return np.memmap(file, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+class SentenceStore(Sequence):
+    r'''
+    Read-only sequence of sentences stored in two files memory-mapped on demand:
+
+        * a .blob file with the sentences encoded in UTF-8. It is only appended, so that it may hold bytes of sentences which were replaced and are not used anymore.
+        * a .offsets file with the number of sentences followed by the position of the start and of the end of each sentence in the blob, as 64 bits integers
+
+    Sentences are only decoded when they are accessed.
+    '''
+
+    def __init__(self, path: str, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param str path: path of the store files without their extension
+        '''
+
+        #: Path of the store files without their extension
+        self.path   = path
+
+        with open(f'{path}.offsets', 'rb') as f:
+            count   = int.from_bytes(f.read(8), 'little')
+
+        #: Position of the start and of the end of each sentence in the blob
+        self.bounds = map_rows(f'{path}.offsets', '<u8', (count, 2), offset=8)
+
+        self.blob   = b''
+        self._map()
+
+    def _map(self) -> None:
+        r'''Map the whole blob.'''
+
+        # mmap cannot map empty files
+        if os.path.getsize(f'{self.path}.blob') > 0:
+            with open(f'{self.path}.blob', 'rb') as f:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return
+
+    def __len__(self) -> int:
+        r'''Number of sentences.'''
+
+        return len(self.bounds)
+
+    def __getitem__(self, pos):
+        r'''
+        Decode the sentence(s) at the given position(s).
+
+        :param pos: position or slice of positions
+        :type pos: int or slice
+
+        :returns: sentence or list of sentences
+        :rtype: str or list[str]
+        '''
+
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self)))]
+
+        if pos < 0:
+            pos += len(self)
+
+        if not 0 <= pos < len(self):
+            raise IndexError(f'Sentence {pos} out of range for a store of {len(self)} sentences.')
+
+        start, end = int(self.bounds[pos, 0]), int(self.bounds[pos, 1])
+
+        # The last sentences may have been replaced by sentences appended to the blob after it was mapped
+        if end > len(self.blob):
+            self._map()
+
+        return self.blob[start:end].decode('utf-8')
+
+    def offsets(self, first: int = 0) -> np.ndarray:
+        r'''
+        Position of the start of each sentence from a given one on, followed by the position of the end of the last sentence. These sentences must follow each other in the blob, as when they are written by a single SentenceStoreWriter.
+
+        :param int first: (**Optional**) position of the first sentence
+
+        :returns: positions in the blob
+        :rtype: ndarray[uint64]
+        '''
+
+        if first >= len(self):
+            return np.zeros(1, dtype=np.uint64)
+
+        return np.append(self.bounds[first:, 0], self.bounds[-1, 1])
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        r'''
+        Check that the store files exist.
+
+        :param str path: path of the store files without their extension
+
+        :returns: True if both files exist, False otherwise
+        :rtype: bool
+        '''
+
+        return os.path.isfile(f'{path}.blob') and os.path.isfile(f'{path}.offsets')
+
+
+class SentenceStoreWriter:
+    r'''
+    Write sentences one by one into the files of a SentenceStore. It must be used as a context manager:
+
+    >>> with SentenceStoreWriter(path) as writer:
+    >>>     writer.append(sentence)
+
+    Files of a new store are written under unique temporary names (see replacing) and only replace the previous store when the writer is closed without error.
+
+    If **keep** is given, the first **keep** sentences of the existing store are kept and the new sentences are appended to its blob, after the bytes of the sentences which are not kept. Only the positions of the new sentences and the number of sentences are then written in place in the offsets file, once the writer is closed without error. No byte of the kept sentences is rewritten and no file is truncated, so that a SentenceStore mapping the existing files can still read them.
+    '''
+
+    def __init__(self, path: str, keep: Optional[int] = None, *args, **kwargs) -> None:
+        r'''
+        Init method for this class.
+
+        :param str path: path of the store files without their extension
+
+        :param int keep: (**Optional**) number of sentences of the existing store to keep. If None, a new store is written.
+        '''
+
+        #: Path of the store files without their extension
+        self.path   = path
+
+        #: Number of sentences kept from the existing store
+        self.keep   = keep
+
+        #: Position of the start and of the end of each new sentence in the blob
+        self.bounds = array('Q')
+
+        #: Position of the end of the blob
+        self.end    = 0
+
+        self.blob   = None
+        self._blob  = None
+
+    def __enter__(self):
+
+        if self.keep is None:
+            self._blob  = replacing(f'{self.path}.blob')
+        else:
+            if self.keep > len(SentenceStore(self.path)):
+                raise ValueError(f'Cannot keep {self.keep} sentences of store {self.path} with {len(SentenceStore(self.path))} sentences.')
+
+            self._blob  = open(f'{self.path}.blob', 'ab')
+
+        self.blob       = self._blob.__enter__()
+        self.end        = self.blob.tell()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+
+        self._blob.__exit__(exc_type, exc_value, traceback)
+
+        if exc_type is not None:
+            return
+
+        count           = np.array([len(self.bounds) // 2 + (self.keep or 0)], dtype='<u8')
+        bounds          = np.asarray(self.bounds, dtype='<u8').reshape(-1, 2)
+
+        if self.keep is None:
+            with replacing(f'{self.path}.offsets') as f:
+                f.write(count.tobytes() + bounds.tobytes())
+        else:
+
+            # The number of sentences is written last, so that it never covers positions which are not written yet
+            write_rows(f'{self.path}.offsets', bounds, start=self.keep, offset=8)
+            write_rows(f'{self.path}.offsets', count,  start=0)
+
+        return
+
+    def append(self, sentence: str) -> None:
+        r'''
+        Append a sentence at the end of the store.
+
+        :param str sentence: sentence to append
+        '''
+
+        size            = self.blob.write(sentence.encode('utf-8'))
+        self.bounds.extend((self.end, self.end + size))
+        self.end       += size
+
+        return
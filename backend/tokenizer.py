@@ -0,0 +1,93 @@
+# Fast word tokenizer giving the same words as nltk word tokenizer
+# Mercier Wilfried - IRAP
+
+import re
+
+#################################################################################
+#                               Regular expressions                             #
+#################################################################################
+
+# Characters always split from the surrounding text by nltk
+_SEPARATORS    = r'\s«“‘„»”’;@#$%&\u2012-\u2015?!*\[\](){}<>"`'
+
+# Period ending the sentence, only followed by closing quotes or brackets
+_FINAL         = r'(?<=[^.])\.(?=[\])}>"\'»”’\s]*\Z)'
+
+# Anything which nltk pads with spaces, so that the token before it ends there
+_END           = rf'(?=[{_SEPARATORS}]|\'\'|[,:](?!\d)|\.\.|--|{_FINAL}|\Z)'
+
+# English clitics split from the end of a token
+_CLITIC        = rf'\'(?:[sSmMdD]|ll|LL|re|RE|ve|VE){_END}|(?:n\'t|N\'T){_END}'
+
+# Opening apostrophe split from the word which follows it
+_OPENING       = r'(?<!\w)\'(?!(?i:re|ve|ll|m|t|s|d|n)\b)(?=\w)'
+
+# English words made of two tokens, only the first part is matched
+_CONTRACTIONS  = r'(?i:\b(?:can(?=not\b)|d(?=\'ye\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)|more(?=\'n\b)|wan(?=na(?:\s|\Z))))'
+
+TOKEN          = re.compile(rf'''
+    (?:                                                       # words, tried first since they are the most frequent tokens
+        (?<=\w)[^\WnN]+ | (?!{_CONTRACTIONS})[^\WnN]+         # letters, except at the start of a contraction
+      | n(?!\'t{_END}) | N(?!\'T{_END})
+      | [^\w{_SEPARATORS},:.\'-]
+      | [,:](?=\d) | (?<=[,:])[,:]
+      | \.(?!\.|[\])}}>"\'»”’\s]*\Z)
+      | -(?!-)
+      | (?!{_OPENING})\'(?!\'|(?:[sSmMdD]|ll|LL|re|RE|ve|VE)?{_END})
+    )+
+  | "|\'\'(?!\')                                            # double quotes, converted to `` or ''
+  | \.{{2,}} | -- | `+ | {_FINAL} | {_CLITIC} | {_OPENING}   # punctuation split as a whole
+  | [«“‘„»”’;@#$%&\u2012-\u2015?!*\[\](){{}}<>]             # single characters
+  | [,:](?!\d)
+  | {_CONTRACTIONS}
+  | \S                                                        # anything left, e.g. a lone apostrophe
+''', re.VERBOSE)
+
+# Characters after which a double quote opens a quotation
+_OPENERS       = ' ([{<«“‘„`'
+
+
+#################################################################################
+#                                   Tokenizers                                  #
+#################################################################################
+
+def span_tokenize(sentence: str) -> list[tuple[str, int, int]]:
+   r'''
+   Split a sentence into tokens, keeping the position of each token in the sentence.
+
+   Tokens are the same as those of nltk.tokenize.NLTKWordTokenizer (i.e. nltk.word_tokenize with preserve_line=True), but they are found in a single pass over the sentence. As with nltk, double quotes are converted to `` when they open a quotation and to '' otherwise, so that the text of these tokens differs from the sentence.
+
+   :param str sentence: sentence to split
+
+   :returns: tokens with their start and end positions in the sentence
+   :rtype: list[tuple[str, int, int]]
+   '''
+
+   tokens        = []
+   for match in TOKEN.finditer(sentence):
+      token      = match.group()
+      start, end = match.span()
+
+      if token == '"' or token == "''":
+         opening = (start == 0 and token == '"') or (start > 0 and sentence[start-1] in _OPENERS) or (start == 1 and sentence[0] == '"')
+         token   = '``' if opening else "''"
+
+      tokens.append((token, start, end))
+
+   return tokens
+
+def word_tokenize(sentence: str) -> list[str]:
+   r'''
+   Split a sentence into tokens. See span_tokenize.
+
+   :param str sentence: sentence to split
+
+   :returns: tokens
+   :rtype: list[str]
+   '''
+
+   # Positions are only needed to convert double quotes
+   if '"' in sentence or "''" in sentence:
+      return [token for token, start, end in span_tokenize(sentence)]
+
+   return TOKEN.findall(sentence)
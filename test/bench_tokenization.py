@@ -0,0 +1,80 @@
+# Benchmark of the serial and parallel tokenization of a large synthetic corpus
+# Mercier Wilfried - IRAP
+#
+# Usage (from the main directory): python3 test/bench_tokenization.py --size 300 --workers 1 2 4 8
+
+import os
+import sys
+import time
+import pickle
+import random
+import hashlib
+import argparse
+import textwrap
+import os.path as opath
+
+sys.path.insert(0, opath.join(opath.dirname(opath.realpath(__file__)), '..'))
+import backend.sentences as snt
+
+def make_corpus(file, size, source, seed=0):
+   '''
+   Write a synthetic corpus made of paragraphs of sentences drawn from a source corpus, with lines wrapped as in usual text files.
+
+   :param str file: file to write
+   :param int size: size of the corpus in MB
+   :param list[str] source: sentences to draw from
+
+   :param int seed: (**Optional**) random seed
+   '''
+
+   rng     = random.Random(seed)
+   written = 0
+
+   with open(file, 'w') as f:
+      while written < size*1024**2:
+         paragraph = '\n'.join(textwrap.wrap(' '.join(rng.choices(source, k=rng.randint(1, 8))), 70)) + '\n\n'
+         written  += f.write(paragraph)
+
+   return
+
+def run(file, workers, language):
+   '''
+   Tokenize a corpus and return the time spent, the number of sentences and a hash of all the sentences.
+   '''
+
+   digest  = hashlib.sha1()
+   nb      = 0
+   start   = time.perf_counter()
+
+   for sentence in snt.iter_sentences(file, language=language, workers=workers):
+      digest.update(sentence.encode())
+      digest.update(b'\0')
+      nb  += 1
+
+   return time.perf_counter() - start, nb, digest.hexdigest()
+
+if __name__ == '__main__':
+   parser  = argparse.ArgumentParser(description='Benchmark of the corpus tokenization.')
+   parser.add_argument('--size',     type=int, default=300,                help='size of the synthetic corpus in MB')
+   parser.add_argument('--workers',  type=int, default=None, nargs='+',    help='numbers of processes to test')
+   parser.add_argument('--language', type=str, default='French',           help='punkt language')
+   parser.add_argument('--file',     type=str, default='bench_corpus.txt', help='synthetic corpus file')
+   args    = parser.parse_args()
+
+   workers = args.workers or sorted({1, 2, 4, os.cpu_count()})
+
+   if not opath.isfile(args.file) or opath.getsize(args.file) < args.size*1024**2:
+      print(f'Writing a synthetic corpus of {args.size} MB into {args.file}...')
+      with open(opath.join(opath.dirname(opath.realpath(__file__)), '..', 'corpus', 'corpus_balzac.pickle'), 'rb') as f:
+         make_corpus(args.file, args.size, pickle.load(f))
+
+   print(f'{"workers":>8} {"time (s)":>10} {"speedup":>8} {"sentences":>10} identical')
+
+   ref     = None
+   for nb in workers:
+      duration, sentences, digest = run(args.file, nb, args.language)
+
+      if ref is None:
+         ref = (duration, digest)
+
+      print(f'{nb:>8d} {duration:>10.1f} {ref[0]/duration:>8.2f} {sentences:>10d} {digest == ref[1]}')
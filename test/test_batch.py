@@ -0,0 +1,167 @@
+# Differential test of the batched and parallel rules against the rules applied to a single sentence, and microbenchmark of them
+# Mercier Wilfried - IRAP
+#
+# Usage (from the main directory): python3 test/test_batch.py [--groups 1000] [--turns 50] [--workers 4]
+
+import sys
+import time
+import yaml
+import random
+import argparse
+import numpy   as np
+import os.path as opath
+
+sys.path.insert(0, opath.join(opath.dirname(opath.realpath(__file__)), '..'))
+import backend           as bkd
+import backend.sentences as snt
+import backend.rules     as rls
+from   backend.batch     import SentenceBatch
+from   backend.language  import Language
+
+#: Language file used by the tests
+LANGUAGE  = opath.join(opath.dirname(opath.realpath(__file__)), '..', 'languages', 'French.yaml')
+
+#: Sentences with alternate forms, upper case letters, repeated words and punctuation
+SENTENCES = ["Où voulez-vous aller ?", "L'été, Œdipe mangea des œufs très tôt ; puis il dit : « Va-t'en, va-t'en ! »",
+             "Le le LE le chat. Chat chat", "a", "", "Je ne sais pas pourquoi il est venu hier soir avec son frère et sa sœur."]
+
+def load_language(alt=True):
+   '''
+   Load the language used by the tests, without writing its language pack.
+
+   :param bool alt: (**Optional**) whether alternate forms are mapped to their letter or not
+
+   :returns: language
+   :rtype: Language
+   '''
+
+   with open(LANGUAGE, 'r') as f:
+      conf = yaml.safe_load(f)
+
+   return Language(conf['vowels'], conf['consonants'], conf['alterations'], alt=alt)
+
+def replay(sentence, language, rule, result):
+   '''
+   Apply to a single sentence the modification made by a batched rule.
+
+   :param Sentence sentence: sentence to modify in place
+   :param Language language: alphabet of the language used
+   :param str rule: name of the rule
+   :param tuple result: values returned by the batched rule for this sentence
+   '''
+
+   if rule == 'Swap':
+      pos = [pos for pos in range(len(sentence)-1) if sentence.tokens[pos:pos+2] == list(result) and sentence.isWord[pos] and sentence.isWord[pos+1] and sentence.gaps[pos+1].isspace()]
+      sentence.swap(pos[0], pos[0]+1)
+
+   elif rule.endswith('_All'):
+      letterOut, letterIn = result
+      snt.change_letter(sentence, language, letterOut, letterIn, [pos for pos in range(len(sentence)) if letterOut in sentence.tokenVowels[pos] + sentence.tokenConsonants[pos]])
+
+   else:
+      word, letterOut, *letterIn = result
+      snt.change_letter(sentence, language, letterOut, ''.join(letterIn), [pos for pos in range(len(sentence)) if sentence.isWord[pos] and sentence.tokens[pos].lower() == word.lower()])
+
+   return
+
+def test_batch(groups=20, turns=30):
+   '''Check that the batched rules modify each sentence as the rules applied to a single sentence would with the same random choices.'''
+
+   for alt in (True, False):
+      language      = load_language(alt)
+      rng           = random.Random(0)
+
+      for text in SENTENCES:
+         sentence   = snt.Sentence(text, language)
+         sentences  = SentenceBatch(sentence, groups)
+         expected   = [sentence.copy() for i in range(groups)]
+         generator  = np.random.default_rng(rng.getrandbits(64))
+
+         for turn in range(turns):
+            rule    = rng.choice(list(rls.RULES))
+            results = rls.RULES[rule].applyBatch(sentences, generator)
+
+            for single, result in zip(expected, results):
+               if result is not None:
+                  replay(single, language, rule, result)
+
+            assert sentences.texts() == [single.text for single in expected], f'{rule} modified "{text}" differently (alt={alt})'
+
+   return
+
+def test_play():
+   '''Check that batched and serial games only modify letters.'''
+
+   language         = load_language()
+   sentence         = snt.Sentence(SENTENCES[1], language)
+   schedule         = list(rls.RULES) * 3
+   ids              = [f'Groupe {i}' for i in range(1, 6)]
+
+   for batch in (True, False):
+      histories, msgs = bkd.playGroups(sentence, language, schedule, ids, random.Random(1), batch=batch)
+
+      assert len(histories) == len(ids) and len(msgs) == len(ids) * len(schedule)
+      for history in histories:
+         assert len(history) == len(schedule) + 1 and history[0] == sentence.text
+         for text in history:
+            assert sorted(char for char in text if not char.isalpha()) == sorted(char for char in sentence.text if not char.isalpha())
+
+   return
+
+def test_quotes():
+   '''Check that straight double quotes are not words, so that swaps never move them.'''
+
+   language         = load_language()
+   sentence         = snt.Sentence('Il dit " bonjour " puis part', language)
+   ids              = [f'Groupe {i}' for i in range(1, 21)]
+
+   assert [token for token, isWord in zip(sentence.tokens, sentence.isWord) if isWord] == snt.make_words(sentence.text)
+
+   for batch in (True, False):
+      histories, msgs = bkd.playGroups(sentence, language, ['Swap'] * 10, ids, random.Random(3), batch=batch)
+
+      for text in (text for history in histories for text in history):
+         assert [pos for pos, char in enumerate(text) if char == '"'] == [7, 17], text
+
+   return
+
+def test_workers():
+   '''Check that the sentences and messages of a game played one group at a time only depend on the seed, whatever the number of processes.'''
+
+   language         = load_language()
+   sentence         = snt.Sentence(SENTENCES[-1], language)
+   schedule         = list(rls.RULES) * 3
+
+   # Enough groups for the pool to be started, see backend.POOL_OVERHEAD
+   ids              = [f'Groupe {i}' for i in range(1, 121)]
+   assert rls.cost(schedule) * len(ids) > bkd.POOL_OVERHEAD
+
+   serial           = bkd.playGroups(sentence, language, schedule, ids, random.Random(2), batch=False)
+   assert bkd.playGroups(sentence, language, schedule, ids, random.Random(2), batch=False, workers=3) == serial
+
+   return
+
+if __name__ == '__main__':
+
+   parser           = argparse.ArgumentParser(description='Compare and time the batched, parallel and serial rules.')
+   parser.add_argument('--groups', type=int, default=1000, help='number of language groups')
+   parser.add_argument('--turns',  type=int, default=50,   help='number of turns')
+   parser.add_argument('--workers', type=int, default=4,   help='number of processes of the parallel games')
+   args             = parser.parse_args()
+
+   test_batch()
+   test_play()
+   test_quotes()
+   test_workers()
+   print('Batched, parallel and serial rules give the same sentences.')
+
+   language         = load_language()
+   sentence         = snt.Sentence(SENTENCES[-1], language)
+   rng              = random.Random(0)
+   schedule         = [rng.choice(rls.implemented(rls.RULES)) for i in range(args.turns)]
+   ids              = [f'Groupe {i}' for i in range(1, args.groups+1)]
+
+   for name, batch, workers in (('serial', False, 1), ('batched', True, 1), ('parallel', False, args.workers)):
+      start         = time.perf_counter()
+      bkd.playGroups(sentence, language, schedule, ids, random.Random(0), batch=batch, workers=workers)
+      print(f'{name:>8}: {time.perf_counter() - start:.3f} s for {args.groups} groups and {args.turns} turns')
@@ -0,0 +1,142 @@
+# Tests of the incremental update of the corpus cache when text is appended to a corpus file
+# Mercier Wilfried - IRAP
+#
+# Usage (from the main directory): python3 test/test_corpus.py
+
+import sys
+import yaml
+import pickle
+import tempfile
+import numpy   as np
+import os.path as opath
+
+sys.path.insert(0, opath.join(opath.dirname(opath.realpath(__file__)), '..'))
+import backend.corpus    as crp
+import backend.sentences as snt
+
+#: Sentences of the bundled corpus, used to write corpus files
+CORPUS   = opath.join(opath.dirname(opath.realpath(__file__)), '..', 'corpus', 'corpus_balzac.pickle')
+
+#: Language file used by the tests
+LANGUAGE = opath.join(opath.dirname(opath.realpath(__file__)), '..', 'languages', 'French.yaml')
+
+def punkt_installed():
+   '''
+   Check whether the nltk punkt data used to split the corpus files into sentences are installed.
+
+   :returns: True if they are installed, False otherwise
+   :rtype: bool
+   '''
+
+   try:
+      snt.load_nltk().data.find(opath.join('tokenizers', 'punkt', 'french.pickle'))
+   except LookupError:
+      return False
+
+   return True
+
+def load_text(size=2000):
+   '''
+   Text of a corpus file made of the first sentences of the bundled corpus, grouped into paragraphs.
+
+   :param int size: (**Optional**) number of sentences
+
+   :returns: text
+   :rtype: str
+   '''
+
+   with open(CORPUS, 'rb') as f:
+      sentences = pickle.load(f)[:size]
+
+   return '\n\n'.join(' '.join(sentences[pos:pos+7]) for pos in range(0, len(sentences), 7)) + '\n'
+
+def load_language():
+   '''
+   Dictionary describing the language used by the tests.
+
+   :returns: vowels, consonants and alternate forms of the letters
+   :rtype: dict
+   '''
+
+   with open(LANGUAGE, 'r') as f:
+      conf = yaml.safe_load(f)
+
+   return {'vowels': conf['vowels'], 'consonants': conf['consonants'], 'map_alternate': {}}
+
+def same_corpus(corpus, expected):
+   '''
+   Check that two corpora hold the same sentences and the same data.
+
+   :param Corpus corpus: corpus to check
+   :param Corpus expected: expected corpus
+   '''
+
+   assert list(corpus.sentences) == list(expected.sentences)
+   assert np.array_equal(corpus.index.counts, expected.index.counts)
+   assert np.array_equal(corpus.letters, expected.letters)
+
+   # The rarity is computed when the feature index is built if text was appended
+   for name in corpus.featureIndex.columns:
+      assert np.allclose(corpus.features[name], expected.featureIndex.columns[name]), name
+
+   return
+
+def test_append(cuts=(0.001, 0.3, 0.5, 0.999)):
+   '''Check that the cache of a corpus file updated after text was appended to it, at several positions, holds the same data as a cache built from the whole file, and that the sentence store is only appended.'''
+
+   if not punkt_installed():
+      import pytest
+      pytest.skip('nltk punkt data are not installed')
+
+   text           = load_text()
+   language       = load_language()
+
+   with tempfile.TemporaryDirectory() as directory:
+      whole       = opath.join(directory, 'whole.txt')
+      with open(whole, 'w') as f:
+         f.write(text)
+
+      expected    = crp.makeCorpus(whole, language)
+
+      for cut in cuts:
+         file     = opath.join(directory, f'cut{cut}.txt')
+         with open(file, 'w') as f:
+            f.write(text[:int(cut*len(text))])
+
+         before    = crp.makeCorpus(file, language)
+         kept      = len(before) - crp.readCache(file)[1]['resume']['provisional']
+         sentences = list(before.sentences)
+
+         with open(opath.splitext(file)[0] + '.blob', 'rb') as f:
+            blob   = f.read()
+
+         with open(file, 'a') as f:
+            f.write(text[int(cut*len(text)):])
+
+         # A cancelled update leaves the previous cache usable
+         try:
+            crp.makeCorpus(file, language, cancel=lambda: True)
+         except crp.LoadingCancelled:
+            pass
+
+         assert crp.appendedCache(file, crp.cacheKey(file, language)) is not None, cut
+
+         corpus    = crp.makeCorpus(file, language)
+         same_corpus(corpus, expected)
+         same_corpus(crp.makeCorpus(file, language), expected)
+
+         with open(opath.splitext(file)[0] + '.blob', 'rb') as f:
+            assert f.read().startswith(blob), cut
+
+         # The store opened before the update still reads the sentences which were kept
+         assert list(before.sentences[:kept]) == sentences[:kept], cut
+
+   return
+
+if __name__ == '__main__':
+
+   if not punkt_installed():
+      print('The corpus cache was not checked since the nltk punkt data are not installed.')
+   else:
+      test_append()
+      print('Corpus caches updated after appending text hold the same data as caches built from whole files.')
@@ -0,0 +1,173 @@
+# Tests of the indexes and of the sampler used to draw sentences from a corpus
+# Mercier Wilfried - IRAP
+#
+# Usage (from the main directory): python3 test/test_index.py
+
+import sys
+import random
+import numpy   as np
+import os.path as opath
+
+sys.path.insert(0, opath.join(opath.dirname(opath.realpath(__file__)), '..'))
+from   backend.index     import FeatureIndex, WordCountIndex, NoRepeatSampler
+
+def random_columns(size, seed=0):
+   '''
+   Features of a fake corpus, with few distinct values for some of them and many for others.
+
+   :param int size: number of sentences
+   :param int seed: (**Optional**) seed of the generator
+
+   :returns: value of each feature for each sentence
+   :rtype: dict
+   '''
+
+   generator        = np.random.default_rng(seed)
+
+   return {'words'   : generator.integers(1, 20, size),
+           'chars'   : generator.integers(1, 400, size),
+           'rarity'  : generator.random(size)
+          }
+
+def random_filters(columns, rng):
+   '''
+   Random range filters on some features, with unbounded sides, empty ranges (low > high) and bounds outside of the values.
+
+   :param dict columns: value of each feature for each sentence
+   :param random.Random rng: random number generator
+
+   :returns: range of values (minimum, maximum) for some features
+   :rtype: dict
+   '''
+
+   filters          = {}
+   for name in rng.sample(list(columns), rng.randint(1, len(columns))):
+      values        = columns[name]
+      span          = values.max() - values.min()
+      low, high     = [values.min() - span/4 + rng.random() * 1.5 * span for i in range(2)]
+
+      if values.dtype.kind == 'i':
+         low, high  = int(low), int(high)
+
+      filters[name] = (None if rng.random() < 0.2 else low, None if rng.random() < 0.2 else high)
+
+   return filters
+
+def brute_force(columns, filters):
+   '''
+   Mask of the sentences satisfying all the filters, checked one feature at a time.
+
+   :param dict columns: value of each feature for each sentence
+   :param dict filters: range of values (minimum, maximum) for some features
+
+   :returns: mask
+   :rtype: ndarray[bool]
+   '''
+
+   mask             = np.ones(len(next(iter(columns.values()))), dtype=bool)
+   for name, (low, high) in filters.items():
+      if low is not None:
+         mask      &= columns[name] >= low
+      if high is not None:
+         mask      &= columns[name] <= high
+
+   return mask
+
+def test_features(size=1000, tries=300):
+   '''Check that the feature index counts and draws the same sentences as a brute-force mask over random range filters.'''
+
+   columns          = random_columns(size)
+   index            = FeatureIndex(columns)
+   rng              = random.Random(0)
+   empty            = 0
+
+   for i in range(tries):
+      filters       = random_filters(columns, rng)
+      mask          = brute_force(columns, filters)
+
+      assert index.count(filters) == mask.sum(), filters
+      assert np.array_equal(index.positions(index.match(filters)), np.flatnonzero(mask)), filters
+
+      for j in range(5):
+         position   = index.draw(filters, rng=rng)
+
+         if not mask.any():
+            assert position is None, filters
+         else:
+            assert position is not None and mask[position], filters
+
+      empty        += not mask.any()
+
+   # Both empty and non empty selections must have been tested
+   assert 0 < empty < tries
+
+   return
+
+def test_edge_filters():
+   '''Check filters with unbounded sides, inverted bounds and bounds outside of the values.'''
+
+   columns          = random_columns(200, seed=1)
+   index            = FeatureIndex(columns)
+
+   for filters in ({'words': (None, None)}, {'words': (5, None)}, {'chars': (None, 100)}, {'words': (12, 3)},
+                   {'words': (-10, 0)}, {'chars': (1000, None)}, {'rarity': (0.25, 0.75), 'words': (3, 3)}):
+      mask          = brute_force(columns, filters)
+      assert index.count(filters) == mask.sum(), filters
+
+      position      = index.draw(filters, rng=random.Random(0))
+      assert (position is None) if not mask.any() else mask[position], filters
+
+   return
+
+def test_no_repeat():
+   '''Check that the sampler draws each sentence in range once before any repetition, then starts again.'''
+
+   counts           = np.random.default_rng(2).integers(1, 15, 500)
+   sampler          = NoRepeatSampler(WordCountIndex(counts))
+   rng              = random.Random(0)
+   eligible         = set(np.flatnonzero((counts >= 4) & (counts <= 8)).tolist())
+
+   for cycle in range(3):
+      drawn         = [sampler.draw(4, 8, rng=rng) for i in range(len(eligible))]
+      assert sorted(drawn) == sorted(eligible), f'sentences repeated before exhausting the range (cycle {cycle})'
+
+   # Sentences drawn with other bounds are not drawn again until the new range is exhausted
+   sampler          = NoRepeatSampler(WordCountIndex(counts))
+   first            = {sampler.draw(4, 8, rng=rng) for i in range(50)}
+   others           = set(np.flatnonzero((counts >= 6) & (counts <= 12)).tolist())
+   drawn            = [sampler.draw(6, 12, rng=rng) for i in range(len(others - first))]
+
+   assert sorted(drawn) == sorted(others - first)
+   assert sampler.draw(6, 12, rng=rng) in others
+   assert sampler.draw(20, 30, rng=rng) is None
+
+   return
+
+def test_sampler_state():
+   '''Check that a sampler created from the state of another one draws the same sentences.'''
+
+   counts           = np.random.default_rng(3).integers(1, 15, 300)
+   index            = WordCountIndex(counts)
+   sampler          = NoRepeatSampler(index)
+   rng              = random.Random(1)
+
+   for i in range(70):
+      sampler.draw(2, 10, rng=rng)
+
+   state            = sampler.state()
+   copy             = NoRepeatSampler(index, **state)
+   assert len(copy) == len(sampler) == 70 and copy.state() == state
+
+   seed             = rng.getrandbits(64)
+   expected         = [sampler.draw(2, 10, rng=random.Random(seed)) for i in range(400)]
+   assert [copy.draw(2, 10, rng=random.Random(seed)) for i in range(400)] == expected
+
+   return
+
+if __name__ == '__main__':
+
+   test_features()
+   test_edge_filters()
+   test_no_repeat()
+   test_sampler_state()
+   print('The feature index agrees with brute-force selections and the sampler does not repeat sentences.')
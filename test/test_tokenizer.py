@@ -0,0 +1,132 @@
+# Differential test of the regex word tokenizer against nltk, and microbenchmark of both
+# Mercier Wilfried - IRAP
+#
+# Usage (from the main directory): python3 test/test_tokenizer.py [--repeat 3]
+
+import sys
+import time
+import pickle
+import argparse
+import os.path as opath
+
+sys.path.insert(0, opath.join(opath.dirname(opath.realpath(__file__)), '..'))
+import backend.tokenizer as tkn
+import backend.sentences as snt
+from   nltk.tokenize     import NLTKWordTokenizer
+
+#: Word tokenizer used by nltk.word_tokenize on each sentence, which the regex tokenizer reproduces
+TREEBANK = NLTKWordTokenizer()
+
+#: Sentences of the bundled corpus
+CORPUS = opath.join(opath.dirname(opath.realpath(__file__)), '..', 'corpus', 'corpus_balzac.pickle')
+
+#: Sentences exercising rules of the nltk tokenizer which do not appear in the bundled corpus
+EDGE_CASES = ['He said "hello" and (""x"") left.', '"Quote" at start', "''Two'' quotes", 'He "said"', '("x")', "'' x", "x ''", '"\'',
+              "I can't, won't; they'll do it's fine.", "Cannot gonna gimme lemme wanna go, more'n d'ye", "xcannot wannabe wanna", "don't DON'T y'all O'Neil's",
+              "'Tis 'twas 'hello' world", "rock 'n' roll", "rock'n'roll's", "the '90s", "'s", "a'", "'a", "a-'b", "abc'", "it's.",
+              "a--b---c", "—tiret— ok", "Prix: 3,36 euros, 12:30 ok: fin:", "a,,b", "a:,b", "a,,",
+              "M. Dupont... et alors.. bon.", "Fin.)\"", "Etc.'", "...", ".", "a .", "x``y`z", "[a]{b}<c>", "@#$%&*",
+              "«Oui», dit-il. – Non ! Pourquoi ?", "l'homme aujourd'hui jusqu'à", "L' arbre",
+              "Good muffins cost $3.88\nin New York.  Please buy me\ntwo of them.\nThanks."]
+
+def load_sentences():
+   '''
+   Load the sentences of the bundled corpus.
+
+   :returns: sentences
+   :rtype: list[str]
+   '''
+
+   with open(CORPUS, 'rb') as f:
+      return pickle.load(f)
+
+def sentence_splitter():
+   '''
+   Sentence splitter used by nltk.word_tokenize.
+
+   :returns: function splitting a text into sentences, or None if the nltk punkt data are not installed
+   :rtype: callable or None
+   '''
+
+   try:
+      snt.load_nltk().sent_tokenize('.')
+   except LookupError:
+      return None
+
+   return snt.load_nltk().sent_tokenize
+
+def test_corpus():
+   '''Check that the regex tokenizer and the nltk word tokenizer give the same words on every sentence of the bundled corpus.'''
+
+   for sentence in load_sentences():
+      assert tkn.word_tokenize(sentence) == TREEBANK.tokenize(sentence), sentence
+
+def test_edge_cases():
+   '''Check that the regex tokenizer and the nltk word tokenizer give the same words on sentences with unusual punctuation.'''
+
+   for sentence in EDGE_CASES:
+      assert tkn.word_tokenize(sentence) == TREEBANK.tokenize(sentence), sentence
+
+def test_nltk_backend():
+   '''Check that the regex tokenizer gives the same words as the nltk backend, i.e. nltk.word_tokenize, on the sentences which nltk does not split again.'''
+
+   split = sentence_splitter()
+   if split is None:
+      import pytest
+      pytest.skip('nltk punkt data are not installed')
+
+   for sentence in load_sentences() + EDGE_CASES:
+      if len(split(sentence)) == 1:
+         assert tkn.word_tokenize(sentence) == snt.nltk_word_tokenize(sentence), sentence
+
+def test_spans():
+   '''Check that token positions point to the token in the sentence, except for converted double quotes.'''
+
+   for sentence in load_sentences() + EDGE_CASES:
+      for token, start, end in tkn.span_tokenize(sentence):
+         assert sentence[start:end] == token or (token in ('``', "''") and sentence[start:end] in ('"', "''")), sentence
+
+def benchmark(sentences, repeat=3):
+   '''
+   Time both tokenizers on a list of sentences and print the time per call.
+
+   :param list[str] sentences: sentences to tokenize
+
+   :param int repeat: (**Optional**) number of runs. The fastest one is kept.
+   '''
+
+   times       = {}
+   for name, tokenize in {'regex': tkn.word_tokenize, 'nltk': TREEBANK.tokenize}.items():
+      best     = float('inf')
+
+      for _ in range(repeat):
+         start = time.perf_counter()
+         for sentence in sentences:
+            tokenize(sentence)
+
+         best  = min(best, time.perf_counter() - start)
+
+      times[name] = best
+
+   for name, duration in times.items():
+      print(f'{name:>6}: {1e6*duration/len(sentences):7.1f} µs per sentence, speedup {times["nltk"]/duration:5.2f}')
+
+   return
+
+if __name__ == '__main__':
+   parser    = argparse.ArgumentParser(description='Differential test and microbenchmark of the word tokenizers.')
+   parser.add_argument('--repeat', type=int, default=3, help='number of benchmark runs')
+   args      = parser.parse_args()
+
+   test_corpus()
+   test_edge_cases()
+   test_spans()
+   print(f'Regex and nltk tokenizers give identical words on {len(load_sentences())} corpus sentences and {len(EDGE_CASES)} edge cases.')
+
+   if sentence_splitter() is None:
+      print('The nltk backend was not checked since the nltk punkt data are not installed.')
+   else:
+      test_nltk_backend()
+      print('Regex tokenizer and nltk backend give identical words on the sentences which nltk does not split again.')
+
+   benchmark(load_sentences(), repeat=args.repeat)